@@ -1,14 +1,30 @@
 from textwrap import dedent
-from typing import Optional
+from typing import Callable, Optional
 
 import geopandas as gpd
 import streamlit as st
-from shapely.geometry import Polygon
 import leafmap.foliumap as leafmap
 from requests import RequestException
 
-from utils.aoi import nominatim_bbox
-from utils.osm import pois_by_keyvalue, pois_by_selectors
+from utils.aoi import lookup_aoi
+from utils.coverage import (
+    allocate,
+    catchment_polygons,
+    category_coverage,
+    category_distances,
+    compute_coverage,
+    coverage_curve,
+    coverage_polygon,
+    nearest_facility,
+)
+from utils.density import density_image
+from utils.export import EXPORT_FORMATS, lazy_export
+from utils.network import load_network, network_nearest_facility
+from utils.osm import explain_layers
+from utils.payload import describe_sizes
+from utils.pipeline import Memo, Pipeline
+from utils.render import add_density, add_points, add_shapes
+from utils.services import OTHER_COLOR, SERVICE_CATEGORIES, area_layers, classify_facilities, fetch_area_layers
 
 st.set_page_config(
     page_title="Agricultural Service Accessibility",
@@ -34,152 +50,138 @@ ARC_GIS_BASEMAPS = {
     "ArcGIS Terrain": "Esri.WorldTerrain",
 }
 
+DISTANCE_METRICS = {
+    "straight": "Straight line",
+    "network": "Road network",
+}
+
 ARC_GIS_OVERLAY = {
     "name": "ArcGIS Global Cropland",
     "url": "https://services.arcgisonline.com/ArcGIS/rest/services/World_Cropland/MapServer/tile/{z}/{y}/{x}",
     "attribution": "Esri, FAO, NASA",
 }
 
-SERVICE_CATEGORIES = {
-    "Krishi Vigyan Kendra": {
-        "color": "#2f7d32",
-        "selectors": ('["office"="government"]["name"~"krishi vigyan kendra",i]',),
-    },
-    "Agri Input & Fertilizer Dealer": {
-        "color": "#ef6c00",
-        "selectors": (
-            '["shop"~"agrarian|agricultural_supplies|fertilizer|farm_supply",i]',
-            '["amenity"="agricultural_service"]',
-            '["shop"="garden_centre"]["name"~"seed|fertilizer",i]',
-        ),
-    },
-    "Seed & Planting Material Centre": {
-        "color": "#558b2f",
-        "selectors": (
-            '["shop"~"seed|nursery",i]',
-            '["amenity"="marketplace"]["name"~"seed",i]',
-        ),
-    },
-    "Cold Storage & Warehousing": {
-        "color": "#1976d2",
-        "selectors": (
-            '["industrial"~"cold_storage",i]',
-            '["man_made"="storage_tank"]["name"~"cold storage",i]',
-            '["building"="warehouse"]["name"~"cold",i]',
-        ),
-    },
-    "Soil & Agronomy Lab": {
-        "color": "#8e24aa",
-        "selectors": (
-            '["amenity"="laboratory"]["name"~"soil|agro",i]',
-            '["amenity"="research_institute"]["name"~"soil|agri",i]',
-        ),
-    },
-    "Agri Machinery & Custom Hiring": {
-        "color": "#c2185b",
-        "selectors": (
-            '["shop"~"agro_equipment|tractor|farm_machinery",i]',
-            '["amenity"="workshop"]["name"~"tractor|agri",i]',
-        ),
-    },
-    "Dairy & Collection Centre": {
-        "color": "#0097a7",
-        "selectors": (
-            '["amenity"="milk_collection"]',
-            '["amenity"="dairy"]',
-            '["man_made"="works"]["name"~"chilling",i]',
-        ),
-    },
-    "Farmer Producer Org / Cooperative": {
-        "color": "#5d4037",
-        "selectors": (
-            '["office"="association"]["name"~"farmer|producer",i]',
-            '["office"="cooperative"]["name"~"agri|milk",i]',
-        ),
-    },
-}
 
-ALL_SELECTORS = tuple(sorted({sel for cfg in SERVICE_CATEGORIES.values() for sel in cfg["selectors"]}))
+MAP_ZOOM = 8
 
+PIPELINE = Pipeline()
 
-@st.cache_data(show_spinner=False)
-def fetch_facilities(area_name: str):
-    bbox = nominatim_bbox(area_name)
-    facilities = pois_by_selectors(bbox, ALL_SELECTORS)
-    if facilities.empty:
-        return bbox, facilities
-    facilities = facilities.copy()
-    facilities["category"] = facilities["tags"].apply(classify_service)
-    facilities["color"] = facilities["category"].apply(
-        lambda c: SERVICE_CATEGORIES.get(c, {"color": "#546e7a"})["color"]
-    )
-    return bbox, facilities
-
-
-@st.cache_data(show_spinner=False)
-def fetch_villages(bbox_tuple):
-    return pois_by_keyvalue(bbox_tuple, "place", "^(village|hamlet)$")
-
-
-def classify_service(tags: dict) -> str:
-    name = (tags.get("name") or "").lower()
-    amenity = (tags.get("amenity") or "").lower()
-    shop = (tags.get("shop") or "").lower()
-    office = (tags.get("office") or "").lower()
-    industrial = (tags.get("industrial") or "").lower()
-    building = (tags.get("building") or "").lower()
-
-    if "krishi vigyan kendra" in name or (
-        office == "government" and "krishi vigyan" in name
-    ):
-        return "Krishi Vigyan Kendra"
-    if shop in {"agrarian", "agricultural_supplies", "fertilizer", "farm_supply"}:
-        return "Agri Input & Fertilizer Dealer"
-    if amenity == "agricultural_service" or "fertilizer" in name or "pesticide" in name:
-        return "Agri Input & Fertilizer Dealer"
-    if "seed" in name or shop in {"seed", "nursery", "garden_centre"}:
-        return "Seed & Planting Material Centre"
-    if ("soil" in name and ("lab" in name or "testing" in name)) or tags.get("laboratory:type"):
-        return "Soil & Agronomy Lab"
-    if amenity == "laboratory" and ("soil" in name or "agro" in name):
-        return "Soil & Agronomy Lab"
-    if amenity == "research_institute" and ("soil" in name or "agri" in name):
-        return "Soil & Agronomy Lab"
-    if industrial == "cold_storage" or ("cold" in name and "storage" in name):
-        return "Cold Storage & Warehousing"
-    if building == "warehouse" and "cold" in name:
-        return "Cold Storage & Warehousing"
-    if "machinery" in name or "tractor" in name or shop in {"agro_equipment", "tractor"}:
-        return "Agri Machinery & Custom Hiring"
-    if amenity == "workshop" and ("tractor" in name or "agri" in name):
-        return "Agri Machinery & Custom Hiring"
-    if amenity in {"milk_collection", "dairy"} or "milk" in name:
-        return "Dairy & Collection Centre"
-    if "producer company" in name or "fpo" in name or "farmers producer" in name:
-        return "Farmer Producer Org / Cooperative"
-    if office in {"association", "cooperative"} and ("farmer" in name or "milk" in name or "agri" in name):
-        return "Farmer Producer Org / Cooperative"
-    if "chilling" in name or "collection centre" in name:
-        return "Dairy & Collection Centre"
-    return "Other"
-
-
-def add_bounds_layer(map_obj, bbox):
-    south, west, north, east = bbox
-    bounds_poly = gpd.GeoSeries(
-        [Polygon([(west, south), (east, south), (east, north), (west, north), (west, south)])],
-        crs="EPSG:4326",
-    )
-    map_obj.add_geojson(bounds_poly.__geo_interface__, layer_name="Search extent")
+
+@PIPELINE.stage("aoi", inputs=("area",))
+def _geocode(area):
+    return lookup_aoi(area)
+
+
+@PIPELINE.stage("bbox", inputs=("aoi",))
+def _bbox(aoi):
+    return aoi.bbox
+
+
+@PIPELINE.stage("layers", inputs=("aoi", "show_villages"))
+def _fetch(aoi, show_villages):
+    """Unclassified facilities and villages inside the area boundary, in a single Overpass round-trip."""
+    return fetch_area_layers(aoi.bbox, show_villages, classify=False, aoi=aoi)
+
+
+@PIPELINE.stage("facilities", inputs=("layers",))
+def _classify(layers):
+    return classify_facilities(layers[0])
+
+
+@PIPELINE.stage("villages", inputs=("layers",))
+def _villages(layers):
+    return layers[1]
+
+
+@PIPELINE.stage("summary", inputs=("facilities",))
+def _summary(facilities):
+    return facilities.groupby("category").size().reset_index(name="count").sort_values("count", ascending=False)
+
+
+@PIPELINE.stage("nearest", inputs=("facilities", "villages", "bbox", "distance_metric"))
+def _nearest(facilities, villages, bbox, distance_metric):
+    """Nearest facility (position) and its km per village; independent of the buffer radius."""
+    if villages.empty:
+        return None
+    if distance_metric == "network":
+        return network_nearest_facility(facilities, villages, bbox)
+    return nearest_facility(facilities, villages)
+
+
+@PIPELINE.stage("nearest_km", inputs=("nearest",))
+def _distances(nearest):
+    return nearest[1] if nearest is not None else None
+
+
+@PIPELINE.stage("coverage", inputs=("facilities", "villages", "nearest_km", "buffer_km"))
+def _coverage(facilities, villages, nearest_km, buffer_km):
+    return compute_coverage(facilities, villages, buffer_km, nearest_km=nearest_km)
+
+
+@PIPELINE.stage("curve", inputs=("nearest_km",))
+def _curve(nearest_km):
+    return coverage_curve(nearest_km)
+
+
+@PIPELINE.stage("density", inputs=("facilities",))
+def _density(facilities):
+    return density_image(facilities["lon"], facilities["lat"])
+
+
+@PIPELINE.stage("allocation", inputs=("facilities", "villages", "nearest"))
+def _allocation(facilities, villages, nearest):
+    """Villages tagged with their serving facility, and the per-facility load table."""
+    return allocate(facilities, villages, *nearest)
+
+
+@PIPELINE.stage("category_km", inputs=("facilities", "villages", "bbox", "distance_metric"))
+def _category_km(facilities, villages, bbox, distance_metric):
+    """Km from each village to the nearest facility of every service category."""
+    if distance_metric != "network":
+        return category_distances(facilities, villages, list(SERVICE_CATEGORIES))
+    graph = load_network(bbox)
+
+    def nearest(fac, vil):
+        return network_nearest_facility(fac, vil, bbox, graph=graph)
+
+    return category_distances(facilities, villages, list(SERVICE_CATEGORIES), nearest=nearest)
+
+
+@PIPELINE.stage("category_coverage", inputs=("category_km", "buffer_km"))
+def _category_coverage(category_km, buffer_km):
+    return category_coverage(category_km, buffer_km)
+
+
+@PIPELINE.stage("village_table", inputs=("allocation", "coverage", "category_coverage"))
+def _village_table(allocation, coverage, category_coverage):
+    """Villages with coverage flag, serving facility and service gaps, as exported."""
+    return allocation[0].join(coverage["villages"].reindex(columns=["covered"])).join(category_coverage[1])
+
+
+@PIPELINE.stage("catchments", inputs=("facilities", "aoi", "allocation"))
+def _catchments(facilities, aoi, allocation):
+    cells = catchment_polygons(facilities, aoi.bbox, boundary=aoi.polygon).join(facilities[["name", "category"]]).join(allocation[1])
+    return cells[~(cells.geometry.isna() | cells.geometry.is_empty)]
+
+
+@PIPELINE.stage("coverage_layer", inputs=("facilities", "buffer_km"))
+def _coverage_layer(facilities, buffer_km):
+    return coverage_polygon(facilities, buffer_km)
+
+
+def add_bounds_layer(map_obj, aoi):
+    """Area boundary (or its bbox when no boundary is known)."""
+    return add_shapes(map_obj, aoi.boundary(), "Search extent", MAP_ZOOM)
 
 
 def render_map(
     facilities: gpd.GeoDataFrame,
     villages: gpd.GeoDataFrame,
-    coverage_geo: Optional[gpd.GeoDataFrame],
-    bbox,
+    coverage_layer: Optional[Callable[[], gpd.GeoDataFrame]],
+    catchment_layer: Optional[Callable[[], gpd.GeoDataFrame]],
+    density_layer: Optional[Callable],
+    aoi,
     basemap_choice: str,
-    show_heatmap: bool,
     overlay_cropland: bool,
 ):
     m = leafmap.Map(minimap_control=False, draw_export=False)
@@ -203,62 +205,46 @@ def render_map(
             st.warning("ArcGIS cropland overlay unavailable right now.")
 
     if facilities.empty:
-        m.set_center((bbox[1] + bbox[3]) / 2, (bbox[0] + bbox[2]) / 2, 7)
+        south, west, north, east = aoi.bbox
+        m.set_center((west + east) / 2, (south + north) / 2, 7)
         m.to_streamlit(height=600)
         return
 
     ctr_lat = facilities.geometry.y.mean()
     ctr_lon = facilities.geometry.x.mean()
-    m.set_center(ctr_lon, ctr_lat, 8)
-    add_bounds_layer(m, bbox)
+    m.set_center(ctr_lon, ctr_lat, MAP_ZOOM)
+    payloads = [add_bounds_layer(m, aoi)]
 
     for category, cfg in SERVICE_CATEGORIES.items():
         subset = facilities[facilities["category"] == category]
         if subset.empty:
             continue
-        m.add_points_from_xy(
-            subset,
-            x="lon",
-            y="lat",
-            layer_name=category,
-            icon_colors=[cfg["color"]] * len(subset),
-            popup=["name", "category"],
-        )
+        add_points(m, subset, category, cfg["color"], popup=["name", "category"])
 
     other = facilities[facilities["category"] == "Other"]
     if not other.empty:
-        m.add_points_from_xy(
-            other,
-            x="lon",
-            y="lat",
-            layer_name="Other agri services",
-            icon_colors=["#546e7a"] * len(other),
-            popup=["name", "category"],
-        )
+        add_points(m, other, "Other agri services", OTHER_COLOR, popup=["name", "category"])
 
-    if show_heatmap and len(facilities) > 3:
-        m.add_heatmap(
-            facilities[["lat", "lon"]],
-            latitude="lat",
-            longitude="lon",
-            name="Facility density",
-        )
+    if density_layer is not None:
+        add_density(m, density_layer(), "Facility density")
+
+    if coverage_layer is not None:
+        coverage_geo = coverage_layer()
+        if not coverage_geo.empty:
+            payloads.append(add_shapes(m, coverage_geo, "Village coverage buffer", MAP_ZOOM))
 
-    if coverage_geo is not None and not coverage_geo.empty:
-        m.add_geojson(coverage_geo.__geo_interface__, layer_name="Village coverage buffer")
+    if catchment_layer is not None:
+        cells = catchment_layer()
+        if not cells.empty:
+            style = {"color": "#37474f", "weight": 1, "fillOpacity": 0.05}
+            popup = ["name", "category", "villages_served", "mean_km", "p95_km"]
+            payloads.append(add_shapes(m, cells, "Facility catchments", MAP_ZOOM, style=style, popup=popup))
 
     if not villages.empty:
-        m.add_points_from_xy(
-            villages,
-            x="lon",
-            y="lat",
-            layer_name="Villages",
-            icon_colors=["#9e9e9e"] * len(villages),
-            popup=["name", "covered"],
-        )
+        add_points(m, villages, "Villages", "#9e9e9e", popup=["name", "covered"])
 
     legend = {category: cfg["color"] for category, cfg in SERVICE_CATEGORIES.items()}
-    legend["Other agri services"] = "#546e7a"
+    legend["Other agri services"] = OTHER_COLOR
     try:
         m.add_legend(title="Agricultural service types", legend_dict=legend)
     except Exception:
@@ -266,36 +252,7 @@ def render_map(
         pass
 
     m.to_streamlit(height=640)
-
-
-def compute_coverage(facilities: gpd.GeoDataFrame, villages: gpd.GeoDataFrame, buffer_km: int):
-    if facilities.empty or villages.empty:
-        return {
-            "total_villages": len(villages),
-            "covered": 0,
-            "pct": 0.0,
-            "coverage_geo": gpd.GeoDataFrame(geometry=[], crs="EPSG:4326"),
-            "villages": villages,
-        }
-
-    buffer_m = buffer_km * 1000
-    facilities_m = facilities.to_crs(3857)
-    coverage_area = facilities_m.buffer(buffer_m)
-    coverage_union = coverage_area.unary_union
-    villages_m = villages.to_crs(3857)
-    villages = villages.copy()
-    villages["covered"] = villages_m.geometry.apply(lambda g: coverage_union.contains(g))
-    total_villages = len(villages)
-    covered = int(villages["covered"].sum())
-    pct = (covered / total_villages) * 100 if total_villages else 0
-    coverage_geo = gpd.GeoSeries([coverage_union], crs=3857).to_crs(4326)
-    return {
-        "total_villages": total_villages,
-        "covered": covered,
-        "pct": pct,
-        "coverage_geo": coverage_geo.to_frame(name="geometry"),
-        "villages": villages,
-    }
+    st.caption(f"Map payload: {describe_sizes(payloads)}")
 
 
 def main():
@@ -314,8 +271,8 @@ def main():
             **How to use**
 
             1. Choose a district, city, or block in the sidebar.
-            2. Select the ArcGIS basemap and analytical overlays.
-            3. Click **Update map** to fetch the latest open data snapshot.
+            2. Click **Update map** to fetch the latest open data snapshot.
+            3. Adjust the basemap, buffer and overlays; the view updates without refetching.
             """
         )
 
@@ -323,35 +280,50 @@ def main():
         st.header("Analysis controls")
         with st.form("controls"):
             area = st.text_input("District / City / Block", "Ranchi, Jharkhand")
-            basemap_choice = st.selectbox("ArcGIS basemap", list(ARC_GIS_BASEMAPS.keys()))
-            buffer_km = st.slider("Village coverage buffer (km)", 1, 25, 10)
             show_villages = st.toggle("Overlay villages (OSM place=village/hamlet)", value=True)
-            heatmap_on = st.toggle("Show density heatmap", value=True)
-            overlay_cropland = st.toggle(
-                "ArcGIS global cropland overlay", value=False,
-                help="Adds the FAO/NASA cropland raster from ArcGIS Living Atlas"
-            )
             submitted = st.form_submit_button("Update map", type="primary")
+        # Display controls apply immediately; the pipeline reuses everything they do not affect.
+        basemap_choice = st.selectbox("ArcGIS basemap", list(ARC_GIS_BASEMAPS.keys()))
+        buffer_km = st.slider("Village coverage buffer (km)", 1, 25, 10)
+        distance_metric = st.selectbox(
+            "Distance to facilities", list(DISTANCE_METRICS), format_func=DISTANCE_METRICS.get,
+            help="Road network distance follows OSM roads (fetched once per area) instead of a straight line.",
+        )
+        heatmap_on = st.toggle("Show density heatmap", value=True)
+        catchments_on = st.toggle(
+            "Show facility catchments (straight-line)" if distance_metric == "network" else "Show facility catchments",
+            value=False, key="catchments",
+            help="Area closest to each facility in a straight line, with the villages it serves."
+            + (" The load table below uses road distance instead." if distance_metric == "network" else ""),
+        )
+        overlay_cropland = st.toggle(
+            "ArcGIS global cropland overlay", value=False,
+            help="Adds the FAO/NASA cropland raster from ArcGIS Living Atlas"
+        )
         st.caption(
             "ArcGIS basemaps and cropland layers © Esri, FAO, NASA (open for non-commercial use)."
         )
 
     tabs = st.tabs(["Interactive map", "Insights", "Data & downloads"])
 
-    if not submitted:
+    if submitted:
+        st.session_state["home_query"] = {"area": area, "show_villages": show_villages}
+    query = st.session_state.get("home_query")
+    if query is None:
         with tabs[0]:
             st.info("Configure the study area in the sidebar and click **Update map** to draw the accessibility view.")
         return
+    area, show_villages = query["area"], query["show_villages"]
+    params = {**query, "buffer_km": buffer_km, "distance_metric": distance_metric}
+    memo = st.session_state.setdefault("home_pipeline", Memo())
+
+    def stage(name):
+        return PIPELINE.run(name, params, memo)
 
     try:
         with st.spinner("Fetching geographies and facilities..."):
-            bbox, facilities = fetch_facilities(area)
-            bbox_tuple = tuple(bbox)
-            villages = (
-                fetch_villages(bbox_tuple)
-                if show_villages
-                else gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
-            )
+            aoi, bbox = stage("aoi"), stage("bbox")
+            facilities, villages = stage("facilities"), stage("villages")
     except ValueError as exc:
         with tabs[0]:
             st.error(str(exc))
@@ -374,17 +346,31 @@ def main():
             st.info("Try a neighbouring district or adjust the search name for broader coverage.")
         return
 
-    coverage = compute_coverage(facilities, villages, buffer_km)
-    coverage_geo = coverage["coverage_geo"] if not coverage["coverage_geo"].empty else None
+    try:
+        with st.spinner("Measuring distances..."):
+            coverage = stage("coverage")
+    except RequestException as exc:
+        with tabs[0]:
+            st.error("Unable to fetch the road network right now. Switch to straight-line distance or retry later.")
+        st.caption(f"Debug info: {exc}")
+        return
+    # Built only when the map draws it, so reruns that do not need the buffer union skip it.
+    # A straight-line buffer would contradict road-network coverage, so it is drawn for that metric only.
+    coverage_layer = (
+        (lambda: stage("coverage_layer")) if coverage["total_villages"] and distance_metric == "straight" else None
+    )
+    catchment_layer = (lambda: stage("catchments")) if catchments_on and coverage["total_villages"] else None
+    density_layer = (lambda: stage("density")) if heatmap_on and len(facilities) > 3 else None
 
     with tabs[0]:
         render_map(
             facilities,
             coverage["villages"],
-            coverage_geo,
-            bbox,
+            coverage_layer,
+            catchment_layer,
+            density_layer,
+            aoi,
             basemap_choice,
-            heatmap_on,
             overlay_cropland,
         )
 
@@ -401,14 +387,39 @@ def main():
             **Facility mix** — Understand which support services dominate and where diversification is required.
             """
         )
-        summary = (
-            facilities.groupby("category").size().reset_index(name="count").sort_values("count", ascending=False)
-        )
+        summary = stage("summary")
         if not summary.empty:
             st.dataframe(summary, use_container_width=True)
             chart_data = summary.set_index("category")
             st.bar_chart(chart_data)
 
+        if coverage["total_villages"]:
+            st.markdown("**Coverage vs. radius** — Share of villages reached as the buffer grows from 1 to 25 km.")
+            curve = stage("curve")
+            st.line_chart(curve.set_index("radius_km")["pct"])
+
+            st.markdown(
+                "**Coverage by service** — A village counts as covered for a service only when a facility of "
+                "that category lies within the buffer."
+            )
+            by_category, gaps = stage("category_coverage")
+            st.bar_chart(by_category.set_index("category")["pct"])
+            st.dataframe(by_category, use_container_width=True, hide_index=True)
+            st.markdown("**Largest service gaps** — Villages missing the most services within the buffer.")
+            st.dataframe(
+                villages[["name"]].join(gaps, how="right").head(25),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+            st.markdown("**Facility load** — Villages served by each facility (nearest facility wins) and how far they are.")
+            load = facilities[["name", "category"]].join(stage("allocation")[1])
+            st.dataframe(
+                load.sort_values("villages_served", ascending=False).head(25),
+                use_container_width=True,
+                hide_index=True,
+            )
+
         if coverage["total_villages"] and coverage["total_villages"] > coverage["covered"]:
             st.warning(
                 f"{coverage['total_villages'] - coverage['covered']:,} villages fall outside the {buffer_km} km reach of mapped facilities."
@@ -422,35 +433,48 @@ def main():
             st.markdown(
                 dedent(
                     """
-                    - **Geocoding** — Boundary derived via Nominatim (OpenStreetMap).
-                    - **Facilities** — Queried live from OpenStreetMap using curated tag selectors for agricultural infrastructure.
+                    - **Geocoding** — Local gazetteer, falling back to Nominatim (OpenStreetMap) for unknown names. Data is fetched and counted inside the area's boundary polygon when one is known, otherwise its bounding box.
+                    - **Facilities** — Queried live from OpenStreetMap using curated tag selectors for agricultural infrastructure, merged by a query planner into as few filters as possible.
                     - **Villages** — OSM `place=village|hamlet` centroids to approximate settlement coverage.
                     - **Basemap & cropland overlay** — ArcGIS Living Atlas services for contextual cartography and cropland intensity.
-                    - **Distance metric** — Straight-line (Euclidean) buffer in Web Mercator. Consider road networks for routing-based studies.
+                    - **Distance metric** — Straight-line distance from each village to its nearest facility, measured in the local UTM zone, or the shortest path along OSM roads (all roads two-way, plus the straight walk to the nearest road at each end). Villages with no road connection to a facility count as uncovered.
                     """
                 )
             )
+            query, cost, naive_cost = explain_layers(bbox, area_layers(show_villages), poly=aoi.overpass_poly)
+            st.caption(f"Overpass query (estimated filter cost {cost:.0f} vs. {naive_cost:.0f} unplanned)")
+            st.code(query, language="text")
 
     with tabs[2]:
         st.subheader("Download datasets")
-        st.download_button(
-            "Download facilities (GeoJSON)",
-            data=facilities.to_json(),
-            file_name=f"agri_services_{area.replace(',', '_').replace(' ', '_')}.geojson",
-            mime="application/geo+json",
+        fmt = st.selectbox(
+            "Format", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f].label,
+            help="Files are generated when you click download and reused until the data changes.",
         )
+        spec = EXPORT_FORMATS[fmt]
+        slug = area.replace(",", "_").replace(" ", "_")
         st.download_button(
-            "Download facilities (CSV)",
-            data=facilities.drop(columns=["geometry"]).to_csv(index=False),
-            file_name=f"agri_services_{area.replace(',', '_').replace(' ', '_')}.csv",
-            mime="text/csv",
+            f"Download facilities ({spec.label})",
+            data=lazy_export(facilities, fmt),
+            file_name=f"agri_services_{slug}{spec.extension}",
+            mime=spec.mime,
+            on_click="ignore",
         )
         if coverage["total_villages"]:
+            load = stage("allocation")[1]
+            st.download_button(
+                f"Download villages with coverage flag ({spec.label})",
+                data=lazy_export(stage("village_table"), fmt),
+                file_name=f"villages_coverage_{slug}{spec.extension}",
+                mime=spec.mime,
+                on_click="ignore",
+            )
             st.download_button(
-                "Download villages with coverage flag (GeoJSON)",
-                data=coverage["villages"].to_json(),
-                file_name=f"villages_coverage_{area.replace(',', '_').replace(' ', '_')}.geojson",
-                mime="application/geo+json",
+                f"Download facilities with load ({spec.label})",
+                data=lazy_export(facilities.join(load), fmt),
+                file_name=f"agri_services_load_{slug}{spec.extension}",
+                mime=spec.mime,
+                on_click="ignore",
             )
 
         st.markdown("### Data preview")
@@ -0,0 +1,98 @@
+"""Compare the row-wise Overpass conversion with the columnar builders in utils.osm.
+
+Run from the repository root:  python -m benchmarks.bench_osm_parse [n_elements]
+"""
+import random
+import sys
+import time
+
+import geopandas as gpd
+from shapely.geometry import LineString
+
+from utils.osm import _elements_to_gdf, _ways_to_gdf
+
+
+def legacy_points(elements, key_hint=None):
+    recs = []
+    for el in elements:
+        if "lon" in el and "lat" in el:
+            lon, lat = el["lon"], el["lat"]
+        elif "center" in el:
+            lon, lat = el["center"]["lon"], el["center"]["lat"]
+        else:
+            continue
+        recs.append({
+            "name": el.get("tags", {}).get("name", ""),
+            "key": key_hint or "",
+            "type": el.get("type", ""),
+            "lon": lon,
+            "lat": lat,
+            "tags": el.get("tags", {})
+        })
+    return gpd.GeoDataFrame(
+        recs,
+        geometry=gpd.points_from_xy([r["lon"] for r in recs], [r["lat"] for r in recs]),
+        crs="EPSG:4326",
+    )
+
+
+def legacy_lines(elements):
+    recs = []
+    for el in elements:
+        if "geometry" not in el:
+            continue
+        coords = [(p["lon"], p["lat"]) for p in el["geometry"]]
+        recs.append({
+            "id": el.get("id"),
+            "name": el.get("tags", {}).get("name", ""),
+            "tags": el.get("tags", {}),
+            "geometry": LineString(coords)
+        })
+    return gpd.GeoDataFrame(recs, crs="EPSG:4326")
+
+
+def synthetic_points(n):
+    rnd = random.Random(1)
+    out = []
+    for i in range(n):
+        lon, lat = 85 + rnd.random(), 23 + rnd.random()
+        tags = {"name": f"facility {i}", "amenity": "dairy"}
+        if i % 3:
+            out.append({"type": "node", "id": i, "lon": lon, "lat": lat, "tags": tags})
+        else:
+            out.append({"type": "way", "id": i, "center": {"lon": lon, "lat": lat}, "tags": tags})
+    return out
+
+
+def synthetic_ways(n, vertices=12):
+    rnd = random.Random(2)
+    out = []
+    for i in range(n):
+        lon, lat = 85 + rnd.random(), 23 + rnd.random()
+        geom = [{"lon": lon + k * 1e-4, "lat": lat + k * 1e-4} for k in range(vertices)]
+        out.append({"type": "way", "id": i, "tags": {"highway": "residential"}, "geometry": geom})
+    return out
+
+
+def timed(fn, arg, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(n=100_000):
+    points = synthetic_points(n)
+    ways = synthetic_ways(n // 4)
+    for label, old, new, data in (
+        ("points", legacy_points, _elements_to_gdf, points),
+        ("lines", legacy_lines, _ways_to_gdf, ways),
+    ):
+        t_old, t_new = timed(old, data), timed(new, data)
+        print(f"{label:<7} n={len(data):>7,}  row-wise {t_old:7.3f}s  columnar {t_new:7.3f}s  speedup {t_old / t_new:4.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -1,7 +1,9 @@
 import streamlit as st
 import leafmap.foliumap as leafmap
 import geopandas as gpd
-from utils.aoi import nominatim_bbox
+from utils.aoi import lookup_aoi
+from utils.export import lazy_export
+from utils.render import add_points
 from utils.osm import pois_by_keyvalue
 
 st.title("Day 01 — Essential Finder (Hospitals, ATMs, Pharmacies)")
@@ -21,8 +23,8 @@ with col1:
 
 if run:
     try:
-        bbox = nominatim_bbox(area)
-        gdf = pois_by_keyvalue(bbox, "amenity", f"^{poi_type}$")
+        aoi = lookup_aoi(area)
+        gdf = aoi.clip(pois_by_keyvalue(aoi.bbox, "amenity", f"^{poi_type}$", poly=aoi.overpass_poly))
         if gdf.empty:
             st.warning("No POIs found. Try a broader area or a different type.")
         else:
@@ -36,18 +38,15 @@ if run:
             gdf = gdf.sort_values("dist_deg").head(limit)
 
             # show on map
-            m.add_points_from_xy(
-                gdf, x="lon", y="lat", layer_name=f"{poi_type}s",
-                popup=["name","key","type"], icon_colors=["red"]*len(gdf)
-            )
+            add_points(m, gdf, f"{poi_type}s", "red", popup=["name","key","type"])
             m.to_streamlit(height=640)
 
             st.subheader("Top results")
             st.dataframe(gdf[["name","lon","lat"]])
 
             st.download_button("Download GeoJSON",
-                               data=gdf.to_json(),
+                               data=lazy_export(gdf, "geojson"),
                                file_name=f"{poi_type}_{area.replace(',','_')}.geojson",
-                               mime="application/geo+json")
+                               mime="application/geo+json", on_click="ignore")
     except Exception as e:
         st.error(str(e))
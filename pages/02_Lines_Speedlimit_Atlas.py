@@ -1,41 +1,87 @@
+import os
+import tempfile
+
 import streamlit as st
 import leafmap.foliumap as leafmap
 import geopandas as gpd
-from utils.aoi import nominatim_bbox
+from utils.aoi import lookup_aoi
+from utils.export import dataset_version, lazy_export
 from utils.osm import lines_by_key
-from utils.style import speed_color
+from utils.payload import describe_sizes, fit_zoom
+from utils.render import LineTiles, add_shapes
+from utils.style import BIN_STYLES, SPEED_COLORS, SPEED_LABELS, geodesic_lengths_km, parse_maxspeed, speed_bins, speed_stats, tag_values
+from utils.tiles import TILE_PUBLIC_URL, TileSet, get_tile_server, write_mbtiles
 
 st.title("Day 02 — Speed-Limit Street Atlas")
 st.caption("OSM highways colored by maxspeed • Exportable • #30DayMapChallenge")
 
 area = st.text_input("Area (city/district):", "Ranchi, India")
 filter_primary = st.checkbox("Only classified roads (primary/secondary/tertiary/trunk/motorway)?", value=False)
+use_tiles = st.checkbox(
+    "Stream as vector tiles", value=bool(TILE_PUBLIC_URL), disabled=not TILE_PUBLIC_URL,
+    help="Sends only the tiles in view. Needs MAPLAB_TILE_PUBLIC_URL, the address at which the browser reaches the tile server."
+)
 run = st.button("Fetch streets")
 
 m = leafmap.Map(minimap_control=False)
 m.add_basemap("CartoDB.DarkMatter")
 
+
+def _mbtiles_bytes(tileset):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "streets.mbtiles")
+        write_mbtiles(tileset, path, max_zoom=14, name="streets")
+        with open(path, "rb") as fh:
+            return fh.read()
+
+
 if run:
     try:
-        bbox = nominatim_bbox(area)
-        extra = ""
-        if filter_primary:
-            # extra filter appended to the key filter in Overpass
-            extra = ']["highway"~"primary|secondary|tertiary|trunk|motorway"]'
-        gdf = lines_by_key(bbox, "highway", extra_filter=extra)
+        aoi = lookup_aoi(area)
+        bbox = aoi.bbox
+        filters = '["highway"~"primary|secondary|tertiary|trunk|motorway"]' if filter_primary else ""
+        gdf = aoi.clip(lines_by_key(bbox, "highway", filters=filters, poly=aoi.overpass_poly))
         if gdf.empty:
             st.warning("No streets found in this AOI.")
         else:
-            # style by maxspeed
-            gdf["maxspeed"] = gdf["tags"].apply(lambda t: t.get("maxspeed","unknown"))
-            # Use GeoJSON direct; leafmap will draw default styles. We'll keep a raw and an info layer.
-            m.add_geojson(leafmap.gdf_to_geojson(gdf[["geometry","name","maxspeed"]]), layer_name="Streets (info)")
-            # A simple legend hint
-            st.info("Legend (approx): ≤30 green • 50 lime • 70 yellow • 90 orange • >90 red • unknown gray")
+            # style by maxspeed: parse each distinct tag once, then bin all segments at once
+            raw = tag_values(gdf["tags"], "maxspeed")
+            gdf["kmh"] = parse_maxspeed(raw)
+            gdf["maxspeed"] = [v if v is not None else "unknown" for v in raw]
+            gdf["speed_bin"] = speed_bins(gdf["kmh"])
+            gdf["color"] = [SPEED_COLORS[b] for b in gdf["speed_bin"]]
+            gdf["length_km"] = geodesic_lengths_km(gdf.geometry.values)
+            version = dataset_version(gdf)
+            make_tileset = lambda: TileSet(gdf, layer="streets", properties=("color", "maxspeed"), detail_properties=("name",))
+            tileset = None
+            if use_tiles and TILE_PUBLIC_URL:
+                try:
+                    server = get_tile_server()
+                    url = server.publish(version, make_tileset)
+                    tileset = server.get(version)
+                    LineTiles(url, "streets", "Streets (maxspeed)", popup=["name", "maxspeed"]).add_to(m)
+                except OSError as exc:
+                    st.info(f"Tile server unavailable ({exc}); drawing streets as GeoJSON instead.")
+            if tileset is None:
+                payload = add_shapes(
+                    m, gdf, "Streets (maxspeed)", fit_zoom(bbox),
+                    style=lambda f: BIN_STYLES[f["properties"]["speed_bin"]],
+                    popup=["name", "maxspeed"], properties=["speed_bin"],
+                )
+                st.caption(f"Map payload: {describe_sizes([payload])}")
+            m.fit_bounds([[bbox[0], bbox[1]], [bbox[2], bbox[3]]])
+            m.add_legend(title="maxspeed (km/h)", legend_dict=dict(zip(SPEED_LABELS, SPEED_COLORS)))
+            st.subheader("Speed limits by road class")
+            st.caption("Length-weighted over geodesic segment lengths; mean excludes untagged and unlimited roads.")
+            st.dataframe(speed_stats(tag_values(gdf["tags"], "highway"), gdf["kmh"], gdf["length_km"]), hide_index=True)
             st.download_button("Download GeoJSON",
-                               data=gdf.to_json(),
+                               data=lazy_export(gdf, "geojson", version),
                                file_name=f"streets_maxspeed_{area.replace(',','_')}.geojson",
-                               mime="application/geo+json")
+                               mime="application/geo+json", on_click="ignore")
+            st.download_button("Download MBTiles",
+                               data=lambda: _mbtiles_bytes(tileset or make_tileset()),
+                               file_name=f"streets_maxspeed_{area.replace(',','_')}.mbtiles",
+                               mime="application/vnd.sqlite3", on_click="ignore")
     except Exception as e:
         st.error(str(e))
 
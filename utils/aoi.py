@@ -1,16 +1,122 @@
-import requests
+import json
+from typing import NamedTuple, Optional
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from utils import http
+from utils.cache import cache_key, get_cache
+from utils.gazetteer import SIMPLIFY_DEG, get_gazetteer
 
 UA = {"User-Agent": "MapLab30/1.0 (+https://example.com)"}
+POLY_MAX_VERTICES = 250  # keeps the Overpass poly: filter short and cheap to evaluate
 
-def nominatim_bbox(area_query: str):
-    """Return (south, west, north, east) bbox for a place name using Nominatim."""
+
+class AOI(NamedTuple):
+    """Area of interest: its bbox plus, when known, the boundary polygon (prepared for fast tests)."""
+
+    name: str
+    bbox: tuple  # (south, west, north, east)
+    polygon: Optional[object] = None  # shapely Polygon/MultiPolygon in EPSG:4326
+
+    @property
+    def overpass_poly(self) -> Optional[str]:
+        """``lat lon ...`` ring for an Overpass ``poly:`` filter, covering the boundary; None without one.
+
+        Multipolygons use their convex hull (a poly filter has a single ring). The ring is
+        grown and simplified by the same tolerance, doubling it until it fits POLY_MAX_VERTICES,
+        so the filter never cuts into the area; ``clip`` then trims the excess.
+        """
+        if self.polygon is None:
+            return None
+        ring = self.polygon if self.polygon.geom_type == "Polygon" else self.polygon.convex_hull
+        tol = SIMPLIFY_DEG
+        while True:
+            outline = ring.buffer(tol, quad_segs=2).simplify(tol).exterior
+            if len(outline.coords) <= POLY_MAX_VERTICES:
+                break
+            tol *= 2
+        lonlat = np.asarray(outline.coords)[:-1]
+        return " ".join(f"{lat:.5f} {lon:.5f}" for lon, lat in lonlat)
+
+    def clip(self, gdf):
+        """Rows of ``gdf`` inside the boundary (points via a vectorised contains_xy, others by intersection)."""
+        if self.polygon is None or gdf.empty:
+            return gdf
+        geoms = gdf.geometry.values
+        if (shapely.get_type_id(geoms) == 0).all():
+            inside = shapely.contains_xy(self.polygon, shapely.get_x(geoms), shapely.get_y(geoms))
+        else:
+            inside = shapely.intersects(self.polygon, geoms)
+        return gdf[inside]
+
+    def boundary(self) -> gpd.GeoDataFrame:
+        """The boundary polygon, or the bbox rectangle when no polygon is known, as a one-row frame."""
+        south, west, north, east = self.bbox
+        geom = self.polygon if self.polygon is not None else shapely.box(west, south, east, north)
+        return gpd.GeoDataFrame({"name": [self.name]}, geometry=[geom], crs="EPSG:4326")
+
+
+def _make_aoi(name, bbox, polygon_geojson):
+    polygon = None
+    if polygon_geojson and polygon_geojson.get("type") in ("Polygon", "MultiPolygon"):
+        polygon = shape(polygon_geojson)
+        shapely.prepare(polygon)
+    return AOI(name, tuple(bbox), polygon)
+
+
+def _nominatim_search(area_query: str, polygon=False):
+    """First Nominatim result for a place name (cached), or raise ValueError.
+
+    With ``polygon=True`` the result carries a ``geojson`` boundary simplified by Nominatim.
+    """
     url = "https://nominatim.openstreetmap.org/search"
     params = {"q": area_query, "format": "json", "limit": 1}
-    r = requests.get(url, params=params, headers=UA, timeout=30)
-    r.raise_for_status()
-    js = r.json()
+    if polygon:
+        params.update(polygon_geojson=1, polygon_threshold=SIMPLIFY_DEG)
+    cache = get_cache()
+    key = cache_key("nominatim", area_query.lower() + (" |polygon" if polygon else ""))
+    body = cache.get(key)
+    if body is None:
+        r = http.request("GET", [url], service="nominatim", params=params, headers=UA, timeout=30)
+        r.raise_for_status()
+        body = r.content
+        if json.loads(body):  # a miss may be transient or fixed in OSM soon, so it is not cached
+            cache.put(key, body)
+    js = json.loads(body)
     if not js:
         raise ValueError("Area not found via Nominatim. Try a broader name (e.g., City, Country).")
-    b = js[0]["boundingbox"]  # [south, north, west, east]
+    return js[0]
+
+def nominatim_bbox(area_query: str):
+    """Return (south, west, north, east) bbox for a place name using Nominatim."""
+    b = _nominatim_search(area_query)["boundingbox"]  # [south, north, west, east]
     south, north, west, east = map(float, b)
     return south, west, north, east
+
+def lookup_aoi(area_query: str) -> AOI:
+    """AOI from the local gazetteer, falling back to Nominatim (with boundary) and remembering the answer."""
+    gaz = get_gazetteer()
+    place = gaz.lookup(area_query)
+    if place is not None:
+        return _make_aoi(place.name, place.bbox, place.polygon)
+    hit = _nominatim_search(area_query, polygon=True)
+    south, north, west, east = map(float, hit["boundingbox"])
+    name = hit.get("display_name", area_query).split(",")[0].strip() or area_query
+    polygon = hit.get("geojson") if hit.get("geojson", {}).get("type") in ("Polygon", "MultiPolygon") else None
+    gaz.add(
+        name,
+        (south, west, north, east),
+        kind=hit.get("addresstype") or hit.get("type") or "",
+        polygon=polygon,
+        aliases=[area_query],
+        source="nominatim",
+    )
+    return _make_aoi(name, (south, west, north, east), polygon)
+
+
+def lookup_bbox(area_query: str):
+    """Bbox from the local gazetteer, falling back to Nominatim and remembering the answer."""
+    return lookup_aoi(area_query).bbox
@@ -0,0 +1,232 @@
+"""Headless accessibility runs for many districts.
+
+Usage:
+    python -m utils.batch areas.txt --out runs/ [--workers N] [--buffer-km 10] [--refresh]
+
+``areas.txt`` holds one area per line: a place name for Nominatim ("Ranchi, Jharkhand")
+or a bbox as "south,west,north,east". Each district is written to ``<out>/<slug>/`` as
+facilities.parquet, villages.parquet and summary.parquet; a ``_SUCCESS`` marker is
+written last, so rerunning the same command skips finished districts and retries failed ones.
+
+``--refresh`` reruns finished districts too, fetching only what changed in OSM since their
+stored snapshot and recomputing classification and nearest facilities only where it matters.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from utils.aoi import AOI, lookup_aoi
+from utils.coverage import compute_coverage, nearest_facility, refresh_nearest
+from utils.export import write_parquet
+from utils.osm import osm_keys
+from utils.ratelimit import RateLimiter, set_rate_limits
+from utils.services import SERVICE_CATEGORIES, classify_facilities, snapshot_area_layers
+
+_BBOX = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+def slugify(area: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", area.lower()).strip("_") or "area"
+
+
+def parse_area(area: str):
+    """Return (bbox or None, name) for an input line."""
+    m = _BBOX.match(area)
+    if m:
+        return tuple(float(v) for v in m.groups()), area.strip()
+    return None, area.strip()
+
+
+def _previous(out_dir, since):
+    """Outputs of the last run if they were built from the snapshot at ``since``, else None."""
+    try:
+        summary = pd.read_parquet(os.path.join(out_dir, "summary.parquet"))
+        if since is None or summary["osm_base"].iloc[0] != since:
+            return None
+        facilities = pd.read_parquet(os.path.join(out_dir, "facilities.parquet"), columns=["type", "id", "category"])
+        villages = pd.read_parquet(
+            os.path.join(out_dir, "villages.parquet"), columns=["type", "id", "nearest_facility", "nearest_facility_km"]
+        )
+    except (OSError, KeyError, ValueError):
+        return None
+    return summary, facilities.set_index(osm_keys(facilities)), villages.set_index(osm_keys(villages))
+
+
+def _nearest(facilities, villages, snapshot, previous):
+    """Nearest facility per village, updated from ``previous`` outputs when there are any."""
+    if previous is None:
+        return nearest_facility(facilities, villages)
+    _, old_facilities, old_villages = previous
+    fac_keys, vil_keys = osm_keys(facilities), osm_keys(villages)
+    changed = snapshot.changes.upserted("facilities")
+    prev_fac = old_villages["nearest_facility"].reindex(vil_keys)
+    position = pd.Series(np.arange(len(facilities)), index=fac_keys)
+    prev_idx = prev_fac.map(position).fillna(-1).astype("int64").to_numpy()
+    prev_km = old_villages["nearest_facility_km"].reindex(vil_keys).to_numpy(dtype="float64")
+    stale = vil_keys.isin(snapshot.changes.upserted("villages")).to_numpy() | prev_fac.isin(changed).to_numpy()
+    return refresh_nearest(facilities, villages, prev_idx, prev_km, fac_keys.isin(changed).to_numpy(), stale)
+
+
+def run_area(area: str, out_dir: str, buffer_km: float, refresh: bool = False) -> dict:
+    """Run the Home.py pipeline for one area and write its outputs under ``out_dir``.
+
+    With ``refresh`` the area's snapshot is brought up to date first and, when the last
+    outputs match the snapshot it started from, only the changed part is recomputed.
+    """
+    bbox, name = parse_area(area)
+    aoi = lookup_aoi(name) if bbox is None else AOI(name, bbox)
+    bbox = aoi.bbox
+    facilities, villages, snapshot = snapshot_area_layers(bbox, aoi=aoi, refresh=refresh)
+    previous = _previous(out_dir, snapshot.since) if snapshot.changes is not None else None
+    if previous is not None and snapshot.changes.count == 0 and previous[0]["buffer_km"].iloc[0] == buffer_km:
+        summary = {**previous[0].iloc[0].to_dict(), "osm_base": snapshot.osm_base, "changed": 0,
+                   "fetched_kb": snapshot.fetched_bytes / 1024}
+        pd.DataFrame([summary]).to_parquet(os.path.join(out_dir, "summary.parquet"), index=False)
+        return summary
+    if previous is not None:
+        facilities = classify_facilities(
+            facilities, previous[1]["category"].to_dict(), snapshot.changes.upserted("facilities")
+        )
+    else:
+        facilities = classify_facilities(facilities)
+    nearest_idx = nearest_km = None
+    if not facilities.empty and not villages.empty:
+        nearest_idx, nearest_km = _nearest(facilities, villages, snapshot, previous)
+    coverage = compute_coverage(facilities, villages, buffer_km, nearest_km=nearest_km)
+    if nearest_idx is not None:
+        keys = osm_keys(facilities).to_numpy()
+        coverage["villages"]["nearest_facility"] = np.where(nearest_idx >= 0, keys[np.maximum(nearest_idx, 0)], None)
+
+    summary = {
+        "area": name,
+        "south": bbox[0],
+        "west": bbox[1],
+        "north": bbox[2],
+        "east": bbox[3],
+        "buffer_km": buffer_km,
+        "facilities": len(facilities),
+        "villages": coverage["total_villages"],
+        "covered": coverage["covered"],
+        "coverage_pct": coverage["pct"],
+        "median_nearest_km": (
+            float(coverage["villages"]["nearest_facility_km"].median())
+            if "nearest_facility_km" in coverage["villages"]
+            else None
+        ),
+        "osm_base": snapshot.osm_base,
+        "changed": snapshot.changes.count if snapshot.changes is not None else None,
+        "fetched_kb": snapshot.fetched_bytes / 1024,
+    }
+    counts = facilities["category"].value_counts() if not facilities.empty else {}
+    for category in SERVICE_CATEGORIES:
+        summary[f"n_{slugify(category)}"] = int(counts.get(category, 0))
+
+    os.makedirs(out_dir, exist_ok=True)
+    success = os.path.join(out_dir, "_SUCCESS")
+    if os.path.exists(success):
+        os.remove(success)
+    for stale in ("facilities.parquet", "villages.parquet"):
+        if os.path.exists(os.path.join(out_dir, stale)):
+            os.remove(os.path.join(out_dir, stale))
+    if not facilities.empty:
+        write_parquet(facilities, os.path.join(out_dir, "facilities.parquet"))
+    if not coverage["villages"].empty:
+        write_parquet(coverage["villages"], os.path.join(out_dir, "villages.parquet"))
+    pd.DataFrame([summary]).to_parquet(os.path.join(out_dir, "summary.parquet"), index=False)
+    open(success, "w").close()
+    return summary
+
+
+def _run_one(area, out_dir, buffer_km, refresh=False):
+    try:
+        return area, run_area(area, out_dir, buffer_km, refresh), None
+    except Exception:
+        return area, None, traceback.format_exc()
+
+
+def run_batch(areas, out_root, workers=None, buffer_km=10.0, overpass_rate=0.5, nominatim_rate=1.0, refresh=False):
+    """Process ``areas`` on a process pool, sharing one API rate limit across workers.
+
+    Finished areas are skipped unless ``refresh`` is set, in which case they are updated.
+    """
+    areas = list(dict.fromkeys(a.strip() for a in areas if a.strip()))
+    pending = []
+    for area in areas:
+        out_dir = os.path.join(out_root, slugify(area))
+        if not refresh and os.path.exists(os.path.join(out_dir, "_SUCCESS")):
+            continue
+        pending.append((area, out_dir))
+    print(f"{len(pending)} areas to run, {len(areas) - len(pending)} already done", file=sys.stderr)
+
+    limiters = {"overpass": RateLimiter(overpass_rate), "nominatim": RateLimiter(nominatim_rate)}
+    failures = []
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_rate_limits, initargs=(limiters,)) as pool:
+        futures = [pool.submit(_run_one, area, out_dir, buffer_km, refresh) for area, out_dir in pending]
+        for done, fut in enumerate(as_completed(futures), 1):
+            area, summary, error = fut.result()
+            if error:
+                failures.append({"area": area, "error": error})
+                status = "FAILED"
+            else:
+                status = f"{summary['facilities']} facilities, {summary['coverage_pct']:.1f}% covered"
+                if summary["changed"] is not None:
+                    status += f", {summary['changed']} OSM changes"
+                status += f", {summary['fetched_kb']:,.1f} KB fetched"
+            print(f"[{done}/{len(pending)}] {area}: {status} ({time.time() - started:.0f}s)", file=sys.stderr)
+
+    if failures:
+        with open(os.path.join(out_root, "failures.jsonl"), "a", encoding="utf-8") as fh:
+            for rec in failures:
+                fh.write(json.dumps(rec) + "\n")
+    return collect_summaries(out_root), failures
+
+
+def collect_summaries(out_root) -> pd.DataFrame:
+    """Concatenate every finished district's summary into ``<out_root>/summary.parquet``."""
+    frames = []
+    for entry in sorted(os.listdir(out_root)):
+        path = os.path.join(out_root, entry, "summary.parquet")
+        if os.path.exists(os.path.join(out_root, entry, "_SUCCESS")) and os.path.exists(path):
+            frames.append(pd.read_parquet(path))
+    if not frames:
+        return pd.DataFrame()
+    summary = pd.concat(frames, ignore_index=True)
+    summary.to_parquet(os.path.join(out_root, "summary.parquet"), index=False)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("areas", nargs="+", help="Files with one area per line, or '-' for stdin.")
+    parser.add_argument("--out", default="runs", help="Output directory (default: runs).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes.")
+    parser.add_argument("--buffer-km", type=float, default=10.0, help="Village coverage radius.")
+    parser.add_argument("--overpass-rate", type=float, default=0.5, help="Max Overpass requests per second.")
+    parser.add_argument("--nominatim-rate", type=float, default=1.0, help="Max Nominatim requests per second.")
+    parser.add_argument("--refresh", action="store_true", help="Update finished areas from OSM changes since their last run.")
+    args = parser.parse_args(argv)
+
+    areas = []
+    for src in args.areas:
+        fh = sys.stdin if src == "-" else open(src, encoding="utf-8")
+        with fh:
+            areas.extend(line for line in fh.read().splitlines() if line.strip() and not line.startswith("#"))
+    os.makedirs(args.out, exist_ok=True)
+    summary, failures = run_batch(
+        areas, args.out, args.workers, args.buffer_km, args.overpass_rate, args.nominatim_rate, args.refresh
+    )
+    print(f"{len(summary)} areas summarised in {os.path.join(args.out, 'summary.parquet')}; {len(failures)} failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+CACHE_DIR = os.environ.get(
+    "MAPLAB_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "maplab30")
+)
+CACHE_TTL = float(os.environ.get("MAPLAB_CACHE_TTL", 7 * 24 * 3600))  # seconds
+CACHE_MAX_BYTES = int(float(os.environ.get("MAPLAB_CACHE_MAX_MB", 512)) * 1024 * 1024)
+
+
+def cache_key(namespace: str, text: str) -> str:
+    """Stable hash of a query with whitespace differences normalised away."""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(f"{namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response cache with TTL expiry and LRU eviction by size."""
+
+    def __init__(self, path=None, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, "responses.sqlite")
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key: str):
+        """Return the cached bytes for ``key`` or None when missing or expired."""
+        blob = self.get_blob(key)
+        return None if blob is None else zlib.decompress(blob)
+
+    def get_blob(self, key: str):
+        """Like ``get`` but returns the stored zlib stream without inflating it."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return row[0]
+
+    def put(self, key: str, payload: bytes):
+        """Store ``payload`` compressed and evict least recently used entries over the cap."""
+        self.put_blob(key, zlib.compress(payload, 6))
+
+    def put_blob(self, key: str, blob: bytes):
+        """Store an already zlib-compressed payload."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+
+_default_cache = None
+_default_pid = None
+_default_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """Process-wide cache shared by every module under ``utils``."""
+    global _default_cache, _default_pid
+    with _default_lock:
+        # SQLite handles must not cross a fork, so worker processes open their own.
+        if _default_cache is None or _default_pid != os.getpid():
+            _default_cache = ResponseCache()
+            _default_pid = os.getpid()
+        return _default_cache
@@ -0,0 +1,200 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+
+def _metric_crs(*frames):
+    """Local UTM zone for the data, so distances are not inflated like in Web Mercator."""
+    for gdf in frames:
+        if not gdf.empty:
+            return gdf.estimate_utm_crs()
+    return "EPSG:3857"
+
+
+def nearest_facility(facilities: gpd.GeoDataFrame, villages: gpd.GeoDataFrame, crs=None):
+    """Positional index of, and distance in km to, each village's nearest facility."""
+    crs = crs or _metric_crs(villages, facilities)
+    fac = facilities.geometry.to_crs(crs).values
+    vil = villages.geometry.to_crs(crs).values
+    tree = shapely.STRtree(fac)
+    (src, dst), dist = tree.query_nearest(vil, return_distance=True, all_matches=False)
+    idx = np.full(len(vil), -1, dtype="int64")
+    km = np.full(len(vil), np.nan)
+    idx[src] = dst
+    km[src] = dist / 1000.0
+    return idx, km
+
+
+def refresh_nearest(facilities, villages, prev_idx, prev_km, changed_facilities, stale_villages):
+    """``nearest_facility`` after an update, searching only where the changes can matter.
+
+    ``prev_idx``/``prev_km`` are the previous results mapped onto the current rows (-1/NaN
+    where unknown); ``changed_facilities`` flags new or modified facilities and
+    ``stale_villages`` the villages that are new, modified or whose nearest facility
+    changed or disappeared. Stale villages get a full search. For the others the old nearest
+    facility is unchanged and still bounds the distance, so only the changed facilities are
+    checked for something closer.
+    """
+    crs = _metric_crs(villages, facilities)
+    idx = np.asarray(prev_idx, dtype="int64").copy()
+    km = np.asarray(prev_km, dtype="float64").copy()
+    stale = np.asarray(stale_villages, dtype=bool) | (idx < 0)
+    changed = np.flatnonzero(changed_facilities)
+    if stale.any():
+        idx[stale], km[stale] = nearest_facility(facilities, villages[stale], crs)
+    if len(changed) and (~stale).any():
+        near_idx, near_km = nearest_facility(facilities.iloc[changed], villages[~stale], crs)
+        closer = near_km < km[~stale]
+        rows = np.flatnonzero(~stale)[closer]
+        idx[rows], km[rows] = changed[near_idx[closer]], near_km[closer]
+    return idx, km
+
+
+def coverage_curve(nearest_km, radii=range(1, 26)):
+    """Share of villages within each radius, from one sort of the nearest distances."""
+    dist = np.sort(np.asarray(nearest_km, dtype="float64"))
+    radii = np.asarray(list(radii), dtype="float64")
+    covered = np.searchsorted(dist, radii, side="right")
+    total = len(dist)
+    return pd.DataFrame({
+        "radius_km": radii,
+        "covered": covered,
+        "pct": covered / total * 100 if total else np.zeros(len(radii)),
+    })
+
+
+def coverage_polygon(facilities: gpd.GeoDataFrame, buffer_km: float) -> gpd.GeoDataFrame:
+    """Union of facility buffers in EPSG:4326 for map display only; not used for the metrics."""
+    if facilities.empty:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    crs = _metric_crs(facilities)
+    union = shapely.union_all(facilities.geometry.to_crs(crs).buffer(buffer_km * 1000).values)
+    return gpd.GeoSeries([union], crs=crs).to_crs(4326).to_frame(name="geometry")
+
+
+def compute_coverage(facilities: gpd.GeoDataFrame, villages: gpd.GeoDataFrame, buffer_km: int, nearest_km=None):
+    """Flag villages within ``buffer_km`` straight-line km of any facility.
+
+    Pass ``nearest_km`` (from ``nearest_facility``) to reuse distances across radii.
+    """
+    if facilities.empty or villages.empty:
+        return {
+            "total_villages": len(villages),
+            "covered": 0,
+            "pct": 0.0,
+            "villages": villages,
+        }
+
+    if nearest_km is None:
+        _, nearest_km = nearest_facility(facilities, villages)
+    villages = villages.copy()
+    villages["nearest_facility_km"] = nearest_km
+    villages["covered"] = villages["nearest_facility_km"] <= buffer_km
+    total_villages = len(villages)
+    covered = int(villages["covered"].sum())
+    pct = (covered / total_villages) * 100 if total_villages else 0
+    return {
+        "total_villages": total_villages,
+        "covered": covered,
+        "pct": pct,
+        "villages": villages,
+    }
+
+
+def allocate(facilities: gpd.GeoDataFrame, villages: gpd.GeoDataFrame, nearest_idx=None, nearest_km=None):
+    """Assign each village to its nearest facility and summarise the load on every facility.
+
+    Pass ``nearest_idx``/``nearest_km`` (from ``nearest_facility`` or a network equivalent) to
+    reuse an existing assignment. Returns ``(villages, load)``: villages gain ``facility_index``
+    (label in ``facilities.index``, missing when unreachable) and ``nearest_facility_km``; ``load`` is
+    indexed like ``facilities`` so ``facilities.join(load)`` adds villages served, mean and
+    95th-percentile km.
+    """
+    if nearest_idx is None or nearest_km is None:
+        nearest_idx, nearest_km = nearest_facility(facilities, villages)
+    nearest_idx = np.asarray(nearest_idx)
+    served = nearest_idx >= 0
+    villages = villages.copy()
+    labels = pd.Series(facilities.index.to_numpy()[np.where(served, nearest_idx, 0)], index=villages.index)
+    villages["facility_index"] = labels.convert_dtypes().where(served)
+    villages["nearest_facility_km"] = nearest_km
+    km = pd.Series(np.asarray(nearest_km, dtype="float64")[served]).groupby(nearest_idx[served])
+    load = pd.DataFrame(
+        {"villages_served": km.size(), "mean_km": km.mean(), "p95_km": km.quantile(0.95)}
+    ).reindex(range(len(facilities)))
+    load["villages_served"] = load["villages_served"].fillna(0).astype("int64")
+    load.index = facilities.index
+    return villages, load.round({"mean_km": 2, "p95_km": 2})
+
+
+def catchment_polygons(facilities: gpd.GeoDataFrame, bbox, boundary=None) -> gpd.GeoDataFrame:
+    """Straight-line catchments: Voronoi cells of the facilities, indexed like ``facilities``.
+
+    Cells are clipped to the ``boundary`` polygon (EPSG:4326) when given, else to ``bbox``.
+    """
+    if facilities.empty:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    south, west, north, east = bbox
+    crs = _metric_crs(facilities)
+    outline = boundary if boundary is not None else shapely.box(west, south, east, north)
+    extent = gpd.GeoSeries([outline], crs="EPSG:4326").to_crs(crs).values[0]
+    points = facilities.geometry.to_crs(crs).values
+    # Coincident facilities share one cell; the first of each keeps it and the rest get empty geometry.
+    _, first = np.unique(shapely.get_coordinates(points).round(3), axis=0, return_index=True)
+    first = np.sort(first)
+    cells = shapely.voronoi_polygons(shapely.multipoints(points[first]), extend_to=extent, ordered=True)
+    geoms = np.full(len(points), None, dtype=object)
+    geoms[first] = shapely.intersection(shapely.get_parts(cells), extent)
+    return gpd.GeoDataFrame(geometry=gpd.GeoSeries(geoms, crs=crs).to_crs(4326).values, index=facilities.index, crs="EPSG:4326")
+
+
+def category_distances(facilities: gpd.GeoDataFrame, villages: gpd.GeoDataFrame, categories, nearest=None):
+    """Villages × categories matrix of km to the nearest facility of each ``category`` (NaN if none exist).
+
+    Both layers are projected once and each category gets its own STRtree queried with all
+    villages in a single batch. Pass ``nearest(facilities, villages) -> (idx, km)`` to measure
+    differently, e.g. along roads.
+    """
+    matrix = pd.DataFrame(np.nan, index=villages.index, columns=list(categories))
+    if villages.empty:
+        return matrix
+    if nearest is None:
+        crs = _metric_crs(villages, facilities)
+        fac = facilities.geometry.to_crs(crs).values
+        vil = villages.geometry.to_crs(crs).values
+    for category in matrix.columns:
+        mask = (facilities["category"] == category).to_numpy()
+        if not mask.any():
+            continue
+        if nearest is not None:
+            matrix[category] = nearest(facilities[mask], villages)[1]
+            continue
+        (src, _), dist = shapely.STRtree(fac[mask]).query_nearest(vil, return_distance=True, all_matches=False)
+        km = np.full(len(vil), np.nan)
+        km[src] = dist / 1000.0
+        matrix[category] = km
+    return matrix
+
+
+def category_coverage(matrix: pd.DataFrame, buffer_km: float):
+    """Per-category coverage table and per-village gaps from a ``category_distances`` matrix.
+
+    A village misses a service when its nearest facility of that category is beyond
+    ``buffer_km`` or does not exist. ``gaps`` ranks villages by services missing, then by
+    ``gap_km``, the total distance beyond the buffer over the reachable missing services.
+    """
+    within = matrix.le(buffer_km)
+    total = len(matrix)
+    table = pd.DataFrame({
+        "category": matrix.columns,
+        "covered": within.sum().to_numpy(),
+        "pct": (within.mean().to_numpy() * 100).round(1) if total else np.zeros(len(matrix.columns)),
+        "median_km": matrix.median().round(2).to_numpy(),
+    })
+    gaps = pd.DataFrame({
+        "services_missing": (~within).sum(axis=1),
+        "gap_km": (matrix - buffer_km).clip(lower=0).sum(axis=1).round(2),
+    }, index=matrix.index)
+    gaps = gaps.sort_values(["services_missing", "gap_km"], ascending=False, kind="stable")
+    return table, gaps
@@ -0,0 +1,118 @@
+"""Facility density computed on the server: Gaussian KDE on a Web Mercator grid, shipped as one PNG overlay."""
+import base64
+import hashlib
+import json
+import math
+import os
+import struct
+import zlib
+from typing import NamedTuple
+
+import numpy as np
+
+from utils.cache import cache_key, get_cache
+
+BANDWIDTH_KM = float(os.environ.get("MAPLAB_DENSITY_BANDWIDTH_KM", 3))
+CELL_KM = float(os.environ.get("MAPLAB_DENSITY_CELL_KM", 0.5))
+MAX_CELLS = 512  # per side; the cell grows for very large areas instead
+EARTH_RADIUS = 6378137.0
+# Colour ramp (light yellow → dark red); opacity rises with density so empty cells stay transparent.
+RAMP = np.array([[255, 255, 178], [254, 204, 92], [253, 141, 60], [240, 59, 32], [189, 0, 38]], dtype="float64")
+MAX_ALPHA = 200
+
+
+class DensityImage(NamedTuple):
+    png: bytes
+    bounds: list  # [[south, west], [north, east]]
+    peak: float  # facilities per km² at the densest cell
+
+    @property
+    def data_url(self) -> str:
+        return "data:image/png;base64," + base64.b64encode(self.png).decode("ascii")
+
+
+def _mercator(lon, lat):
+    x = EARTH_RADIUS * np.radians(lon)
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    return x, y
+
+
+def _lonlat(x, y):
+    return math.degrees(x / EARTH_RADIUS), math.degrees(2 * math.atan(math.exp(y / EARTH_RADIUS)) - math.pi / 2)
+
+
+def _gaussian_kde(counts, sigma_cells):
+    """Convolve ``counts`` with a Gaussian via zero-padded real FFTs (no wrap-around)."""
+    ny, nx = counts.shape
+    radius = int(math.ceil(3 * sigma_cells))
+    offsets = np.arange(-radius, radius + 1)
+    g = np.exp(-0.5 * (offsets / sigma_cells) ** 2)
+    kernel = np.outer(g, g)
+    kernel /= kernel.sum()
+    shape = (ny + 2 * radius, nx + 2 * radius)
+    spectrum = np.fft.rfft2(counts, shape) * np.fft.rfft2(kernel, shape)
+    full = np.fft.irfft2(spectrum, shape)
+    return np.clip(full[radius:radius + ny, radius:radius + nx], 0, None)
+
+
+def density_grid(lon, lat, bandwidth_km=BANDWIDTH_KM, cell_km=CELL_KM):
+    """Density in points per km² on a regular EPSG:3857 grid, north row first, and its lon/lat bounds.
+
+    Mercator stretches distances by 1/cos(latitude); cell size and bandwidth are scaled by
+    that factor at the centre of the points so both stay true ground distances.
+    """
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    scale = 1 / math.cos(math.radians(float(np.mean(lat))))
+    x, y = _mercator(lon, lat)
+    pad = 3 * bandwidth_km * 1000 * scale
+    x0, x1, y0, y1 = x.min() - pad, x.max() + pad, y.min() - pad, y.max() + pad
+    cell = max(cell_km * 1000 * scale, (x1 - x0) / MAX_CELLS, (y1 - y0) / MAX_CELLS)
+    nx, ny = int(math.ceil((x1 - x0) / cell)), int(math.ceil((y1 - y0) / cell))
+    x1, y1 = x0 + nx * cell, y0 + ny * cell
+    counts, _, _ = np.histogram2d(y, x, bins=(ny, nx), range=((y0, y1), (x0, x1)))
+    density = _gaussian_kde(counts, bandwidth_km * 1000 * scale / cell)
+    density /= (cell / scale / 1000) ** 2  # ground area of one cell in km²
+    west, south = _lonlat(x0, y0)
+    east, north = _lonlat(x1, y1)
+    return density[::-1], [[south, west], [north, east]]
+
+
+def _png(rgba) -> bytes:
+    """Minimal RGBA PNG writer (zlib + struct), so no imaging library is needed."""
+    height, width, _ = rgba.shape
+    raw = np.hstack([np.zeros((height, 1), dtype="uint8"), rgba.reshape(height, -1)]).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b"")
+
+
+def colorize(density) -> np.ndarray:
+    """RGBA image of ``density`` scaled to its peak, transparent where it is ~0."""
+    level = density / density.max() if density.max() > 0 else density
+    pos = level * (len(RAMP) - 1)
+    lo = np.clip(np.floor(pos).astype(int), 0, len(RAMP) - 2)
+    frac = (pos - lo)[..., None]
+    rgb = RAMP[lo] * (1 - frac) + RAMP[lo + 1] * frac
+    alpha = np.where(level < 0.02, 0, MAX_ALPHA * np.sqrt(level))
+    return np.dstack([rgb, alpha]).round().astype("uint8")
+
+
+def density_image(lon, lat, bandwidth_km=BANDWIDTH_KM, cell_km=CELL_KM):
+    """KDE overlay for the points, cached in the response cache by coordinates and parameters."""
+    lon = np.ascontiguousarray(lon, dtype="float64")
+    lat = np.ascontiguousarray(lat, dtype="float64")
+    digest = hashlib.sha1(lon.tobytes() + lat.tobytes()).hexdigest()
+    cache = get_cache()
+    key = cache_key("density", f"{digest}:{bandwidth_km}:{cell_km}")
+    cached = cache.get(key)
+    if cached is not None:
+        meta = json.loads(cached[:cached.index(b"\n")])
+        return DensityImage(cached[cached.index(b"\n") + 1:], meta["bounds"], meta["peak"])
+    density, bounds = density_grid(lon, lat, bandwidth_km, cell_km)
+    image = DensityImage(_png(colorize(density)), bounds, float(density.max()))
+    cache.put(key, json.dumps({"bounds": image.bounds, "peak": image.peak}).encode("utf-8") + b"\n" + image.png)
+    return image
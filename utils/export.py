@@ -0,0 +1,101 @@
+"""Download payloads built on demand, written in chunks and memoised in the response cache."""
+import gzip
+import hashlib
+import io
+import json
+from typing import Callable, NamedTuple
+
+import pandas as pd
+
+from utils.cache import cache_key, get_cache
+
+CHUNK_ROWS = 5_000
+
+
+def _json_columns(frame):
+    """Copy with dict/list columns (e.g. OSM ``tags``) serialised as JSON text, for tabular formats."""
+    out = frame.copy()
+    for col in out.columns:
+        if out[col].dtype == object and out[col].map(lambda v: isinstance(v, (dict, list))).any():
+            out[col] = out[col].map(lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v)
+    return out
+
+
+def write_geojson(gdf, fh):
+    """FeatureCollection written CHUNK_ROWS features at a time, so only one chunk is ever serialised."""
+    fh.write(b'{"type": "FeatureCollection", "features": [')
+    for start in range(0, len(gdf), CHUNK_ROWS):
+        features = gdf.iloc[start:start + CHUNK_ROWS].to_geo_dict()["features"]
+        text = json.dumps(features, ensure_ascii=False)[1:-1]
+        fh.write(((", " if start else "") + text).encode("utf-8"))
+    fh.write(b"]}")
+
+
+def write_geojson_gz(gdf, fh):
+    with gzip.GzipFile(fileobj=fh, mode="wb", compresslevel=6, mtime=0) as gz:
+        write_geojson(gdf, gz)
+
+
+def write_csv(gdf, fh):
+    table = pd.DataFrame(_json_columns(gdf).drop(columns=[gdf.geometry.name]))
+    for start in range(0, len(table), CHUNK_ROWS):
+        chunk = table.iloc[start:start + CHUNK_ROWS].to_csv(index=False, header=start == 0)
+        fh.write(chunk.encode("utf-8"))
+
+
+def write_parquet(gdf, path_or_fh):
+    """GeoParquet (or plain Parquet for a DataFrame) with JSON-encoded ``tags``."""
+    _json_columns(gdf).to_parquet(path_or_fh, index=False)
+
+
+def write_flatgeobuf(gdf, fh):
+    _json_columns(gdf).to_file(fh, driver="FlatGeobuf")
+
+
+class ExportFormat(NamedTuple):
+    label: str
+    extension: str
+    mime: str
+    writer: Callable
+
+
+EXPORT_FORMATS = {
+    "geojson": ExportFormat("GeoJSON", ".geojson", "application/geo+json", write_geojson),
+    "geojson.gz": ExportFormat("GeoJSON (gzip)", ".geojson.gz", "application/gzip", write_geojson_gz),
+    "csv": ExportFormat("CSV", ".csv", "text/csv", write_csv),
+    "parquet": ExportFormat("GeoParquet", ".parquet", "application/vnd.apache.parquet", write_parquet),
+    "fgb": ExportFormat("FlatGeobuf", ".fgb", "application/octet-stream", write_flatgeobuf),
+}
+
+
+def dataset_version(frame) -> str:
+    """Content fingerprint of a (Geo)DataFrame, for callers without a pipeline fingerprint."""
+    table = _json_columns(frame)
+    if hasattr(table, "geometry"):
+        table = pd.DataFrame(table.drop(columns=[table.geometry.name])).assign(_wkb=table.geometry.to_wkb())
+    digest = hashlib.sha1(",".join(map(str, table.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def export_bytes(gdf, fmt: str, version: str = None) -> bytes:
+    """Payload of ``gdf`` in ``fmt``, built once per dataset ``version`` and then served from cache.
+
+    ``version`` defaults to ``dataset_version(gdf)``. It must change whenever the data does,
+    because the cache is shared across sessions and restarts.
+    """
+    version = version or dataset_version(gdf)
+    cache = get_cache()
+    key = cache_key("export", f"{fmt}:{version}")
+    payload = cache.get(key)
+    if payload is None:
+        buf = io.BytesIO()
+        EXPORT_FORMATS[fmt].writer(gdf, buf)
+        payload = buf.getvalue()
+        cache.put(key, payload)
+    return payload
+
+
+def lazy_export(gdf, fmt: str, version: str = None):
+    """Zero-argument callable for ``st.download_button(data=...)``: nothing is built (or hashed) until clicked."""
+    return lambda: export_bytes(gdf, fmt, version)
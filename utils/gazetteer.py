@@ -0,0 +1,221 @@
+"""Local place-name index so known areas resolve without a Nominatim round-trip.
+
+Build it from a boundary or place file, then query it:
+    python -m utils.gazetteer build india_districts.geojson --kind district --state-col st_nm
+    python -m utils.gazetteer lookup "Ranchi, Jharkhand"
+"""
+import argparse
+import csv
+import difflib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from typing import NamedTuple, Optional
+
+from utils.cache import CACHE_DIR
+
+GAZETTEER_PATH = os.environ.get("MAPLAB_GAZETTEER", os.path.join(CACHE_DIR, "gazetteer.sqlite"))
+FUZZY_MIN_RATIO = 0.88
+SIMPLIFY_DEG = 0.001  # ~100 m, plenty for an Overpass poly filter or an outline on the map
+
+_NOISE = re.compile(r"\b(district|distt|dist|india|bharat)\b")
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize(text: str) -> str:
+    text = _NOISE.sub(" ", text.lower())
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+class Place(NamedTuple):
+    name: str
+    kind: str
+    state: str
+    bbox: tuple  # (south, west, north, east)
+    polygon: Optional[dict]  # simplified GeoJSON geometry, if known
+
+
+class Gazetteer:
+    """SQLite index of places with exact alias lookup and trigram fuzzy matching."""
+
+    def __init__(self, path=GAZETTEER_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS places (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL DEFAULT '',
+                state TEXT NOT NULL DEFAULT '',
+                south REAL, west REAL, north REAL, east REAL,
+                polygon TEXT,
+                source TEXT NOT NULL DEFAULT 'file'
+            );
+            CREATE TABLE IF NOT EXISTS aliases (
+                norm TEXT NOT NULL,
+                place_id INTEGER NOT NULL REFERENCES places(id),
+                PRIMARY KEY (norm, place_id)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS aliases_fts USING fts5(norm, place_id UNINDEXED, tokenize='trigram');
+            """
+        )
+
+    def add(self, name, bbox, kind="", state="", polygon=None, aliases=(), source="file"):
+        """Insert a place and index its name, "name state" and any extra aliases."""
+        south, west, north, east = bbox
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO places (name, kind, state, south, west, north, east, polygon, source)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, kind, state, south, west, north, east,
+                 json.dumps(polygon) if polygon else None, source),
+            )
+            self._index(cur.lastrowid, [name, f"{name} {state}", f"{name} {kind} {state}", *aliases])
+            return cur.lastrowid
+
+    def _index(self, place_id, names):
+        norms = {normalize(n) for n in names if n and normalize(n)}
+        for norm in norms:
+            inserted = self._db.execute(
+                "INSERT OR IGNORE INTO aliases (norm, place_id) VALUES (?, ?)", (norm, place_id)
+            ).rowcount
+            if inserted:
+                self._db.execute("INSERT INTO aliases_fts (norm, place_id) VALUES (?, ?)", (norm, place_id))
+
+    def _place(self, place_id):
+        row = self._db.execute(
+            "SELECT name, kind, state, south, west, north, east, polygon FROM places WHERE id = ?", (place_id,)
+        ).fetchone()
+        name, kind, state, s, w, n, e, polygon = row
+        return Place(name, kind, state, (s, w, n, e), json.loads(polygon) if polygon else None)
+
+    def lookup(self, query: str, fuzzy=True) -> Optional[Place]:
+        """Best match for ``query``: exact alias first, then the closest trigram candidate."""
+        norm = normalize(query)
+        if not norm:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT place_id FROM aliases WHERE norm = ? LIMIT 1", (norm,)).fetchone()
+            if row:
+                return self._place(row[0])
+            if not fuzzy or len(norm) < 3:
+                return None
+            best, best_ratio = None, FUZZY_MIN_RATIO
+            for cand, place_id in self._candidates(norm, 25):
+                ratio = difflib.SequenceMatcher(None, norm, cand).ratio()
+                if ratio >= best_ratio:
+                    best, best_ratio = place_id, ratio
+            return self._place(best) if best is not None else None
+
+    def _candidates(self, norm, limit):
+        grams = {norm[i:i + 3] for i in range(len(norm) - 2)}
+        match = " OR ".join('"' + g.replace('"', '""') + '"' for g in grams)
+        return self._db.execute(
+            "SELECT norm, place_id FROM aliases_fts WHERE aliases_fts MATCH ? ORDER BY rank LIMIT ?",
+            (match, limit),
+        ).fetchall()
+
+    def suggest(self, prefix: str, limit=10):
+        """Place labels ("Name, State") whose aliases start with ``prefix``, for autocomplete."""
+        norm = normalize(prefix)
+        if not norm:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT p.name, p.state FROM aliases a JOIN places p ON p.id = a.place_id"
+                " WHERE a.norm >= ? AND a.norm < ? ORDER BY length(a.norm) LIMIT ?",
+                (norm, norm + "\U0010ffff", limit),
+            ).fetchall()
+        return [f"{name}, {state}" if state else name for name, state in rows]
+
+    def add_alias(self, place_id, alias):
+        with self._lock:
+            self._index(place_id, [alias])
+
+    def build_from_file(self, path, name_col="name", kind_col="kind", state_col="state", kind=""):
+        """Load places from CSV (name, kind, state, south, west, north, east) or any vector file."""
+        count = 0
+        with self._lock:
+            self._db.execute("BEGIN")
+        try:
+            if path.lower().endswith(".csv"):
+                with open(path, newline="", encoding="utf-8") as fh:
+                    for row in csv.DictReader(fh):
+                        bbox = tuple(float(row[k]) for k in ("south", "west", "north", "east"))
+                        self.add(row[name_col], bbox, row.get(kind_col) or kind, row.get(state_col) or "")
+                        count += 1
+            else:
+                import geopandas as gpd
+
+                gdf = gpd.read_file(path).to_crs(4326)
+                simplified = gdf.geometry.simplify(SIMPLIFY_DEG, preserve_topology=True)
+                for (_, row), geom in zip(gdf.iterrows(), simplified):
+                    if geom is None or geom.is_empty:
+                        continue
+                    west, south, east, north = geom.bounds
+                    polygon = geom.__geo_interface__ if geom.geom_type in ("Polygon", "MultiPolygon") else None
+                    self.add(
+                        str(row[name_col]),
+                        (south, west, north, east),
+                        str(row[kind_col]) if kind_col in row and row[kind_col] else kind,
+                        str(row[state_col]) if state_col in row and row[state_col] else "",
+                        polygon,
+                    )
+                    count += 1
+        except Exception:
+            with self._lock:
+                self._db.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._db.execute("COMMIT")
+        return count
+
+
+_default = None
+_default_pid = None
+_default_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    global _default, _default_pid
+    with _default_lock:
+        if _default is None or _default_pid != os.getpid():
+            _default, _default_pid = Gazetteer(), os.getpid()
+        return _default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the local gazetteer.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    build = sub.add_parser("build", help="Add places from a CSV or vector file.")
+    build.add_argument("path")
+    build.add_argument("--name-col", default="name")
+    build.add_argument("--kind-col", default="kind")
+    build.add_argument("--state-col", default="state")
+    build.add_argument("--kind", default="", help="Kind for rows without one (e.g. district).")
+    lookup = sub.add_parser("lookup", help="Resolve a place name.")
+    lookup.add_argument("query")
+    args = parser.parse_args(argv)
+
+    gaz = get_gazetteer()
+    if args.cmd == "build":
+        n = gaz.build_from_file(args.path, args.name_col, args.kind_col, args.state_col, args.kind)
+        print(f"Indexed {n} places into {gaz.path}")
+    else:
+        place = gaz.lookup(args.query)
+        if place is None:
+            print("No match")
+            return 1
+        print(f"{place.name} ({place.kind}, {place.state}) bbox={place.bbox}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
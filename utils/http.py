@@ -0,0 +1,160 @@
+import email.utils
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.ratelimit import throttle
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = int(os.environ.get("MAPLAB_HTTP_RETRIES", 3))
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_MAX = 30.0
+RETRY_AFTER_MAX = 120.0
+POOL_SIZE = int(os.environ.get("MAPLAB_HTTP_POOL", 16))
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_metrics_hook = None
+
+
+def get_session() -> requests.Session:
+    """Process-wide keep-alive session that keeps up to POOL_SIZE idle connections per host.
+
+    The pool does not block: when it is exhausted an extra connection is opened and
+    discarded afterwards, so a connection that is never released cannot hang the app.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE, pool_block=False, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+
+def set_metrics_hook(hook):
+    """Register ``hook(event, info)`` for "request", "retry" and "failover" events; None disables it."""
+    global _metrics_hook
+    _metrics_hook = hook
+
+
+def _emit(event, **info):
+    if _metrics_hook is not None:
+        try:
+            _metrics_hook(event, info)
+        except Exception:
+            pass
+
+
+class EndpointPool:
+    """Interchangeable endpoints ranked by recent health.
+
+    Each endpoint keeps an exponentially weighted success rate and latency. Endpoints
+    that answered with Retry-After are skipped until it expires, unless all of them are.
+    """
+
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self._lock = threading.Lock()
+        self._ok = {url: 1.0 for url in self.urls}
+        self._latency = {url: 0.0 for url in self.urls}
+        self._cooldown = {url: 0.0 for url in self.urls}
+
+    def ranked(self):
+        now = time.time()
+        with self._lock:
+            return sorted(
+                self.urls,
+                key=lambda u: (self._cooldown[u] > now, -(self._ok[u] / (1.0 + self._latency[u] / 10.0))),
+            )
+
+    def report(self, url, ok, latency=None, retry_after=None):
+        with self._lock:
+            self._ok[url] = 0.7 * self._ok[url] + 0.3 * (1.0 if ok else 0.0)
+            if latency is not None:
+                self._latency[url] = 0.7 * self._latency[url] + 0.3 * latency
+            if retry_after:
+                self._cooldown[url] = time.time() + retry_after
+
+    def health(self) -> dict:
+        with self._lock:
+            return {u: {"ok": self._ok[u], "latency": self._latency[u]} for u in self.urls}
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None  # malformed header: fall back to the normal backoff
+    return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def _settle(response):
+    """Read an error response's (small) body so its connection is released even if the caller only raises."""
+    if not response.ok:
+        response.content
+        response.close()
+    return response
+
+
+def request(method, endpoints, service=None, retries=None, **kwargs) -> requests.Response:
+    """Send an idempotent request, retrying with jittered backoff and failing over across endpoints.
+
+    ``endpoints`` is an EndpointPool or a list of URLs. Retries cover connection errors,
+    timeouts and the statuses in RETRY_STATUS; Retry-After is honoured when given. The
+    last response is returned as-is (callers still ``raise_for_status``), and the last
+    exception is re-raised when no response was received at all.
+    """
+    pool = endpoints if isinstance(endpoints, EndpointPool) else EndpointPool(endpoints)
+    retries = MAX_RETRIES if retries is None else retries
+    session = get_session()
+    for attempt in range(retries + 1):
+        url = pool.ranked()[0]
+        if service:
+            throttle(service)
+        started = time.time()
+        error, response, wait_hint = None, None, None
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            error = exc
+        latency = time.time() - started
+        status = response.status_code if response is not None else None
+        _emit("request", url=url, status=status, latency=latency, attempt=attempt, error=repr(error) if error else None)
+        if response is not None and status not in RETRY_STATUS:
+            pool.report(url, True, latency)
+            return _settle(response)
+        if response is not None:
+            wait_hint = _retry_after(response)
+        pool.report(url, False, latency, wait_hint)
+        if attempt == retries:
+            if response is not None:
+                return _settle(response)
+            raise error
+        if response is not None:
+            response.close()
+        next_url = pool.ranked()[0]
+        if next_url != url:
+            # Another endpoint is healthier: switch right away, with only a short jitter.
+            delay = random.uniform(0, BACKOFF_BASE)
+            _emit("failover", url=url, next_url=next_url, status=status)
+        elif wait_hint is not None:
+            delay = min(wait_hint, RETRY_AFTER_MAX)
+        else:
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        _emit("retry", url=url, status=status, attempt=attempt + 1, delay=delay)
+        time.sleep(delay)
@@ -0,0 +1,181 @@
+"""Road-network distances: a compact CSR graph built from OSM ways and multi-source Dijkstra over it.
+
+Nodes are way vertices merged by coordinate, so ways that share a vertex are connected.
+Villages and facilities are snapped to the nearest road segment; the walk to the road is
+added at both ends. Roads are treated as two-way.
+"""
+import os
+import time
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from utils.cache import CACHE_DIR, CACHE_TTL, cache_key
+from utils.osm import lines_by_key
+from utils.style import parse_maxspeed, tag_values
+
+NETWORK_DIR = os.environ.get("MAPLAB_NETWORK_DIR", os.path.join(CACHE_DIR, "networks"))
+# Ways that cannot be travelled (yet) are left out of the graph.
+EXCLUDED_HIGHWAYS = "proposed|construction|abandoned|disused|platform|raceway|elevator"
+# Assumed km/h where a way has no usable maxspeed tag.
+DEFAULT_SPEEDS = {
+    "motorway": 80, "trunk": 60, "primary": 50, "secondary": 40, "tertiary": 30,
+    "unclassified": 25, "residential": 20, "living_street": 10, "service": 15, "track": 15,
+    "path": 5, "footway": 5, "bridleway": 5, "steps": 3, "pedestrian": 5, "cycleway": 12,
+}
+DEFAULT_SPEED = 20
+MAX_SPEED = 100  # applied to maxspeed=none
+OFFROAD_KMH = 5  # walking speed from a village or facility to the nearest road
+COORD_SCALE = 1e7  # vertices closer than 1e-7° are the same node
+_EPS = 1e-3  # scipy treats 0-weight entries as missing edges
+
+
+class RoadGraph:
+    """Undirected road graph held in flat arrays: node coordinates and per-edge length and speed."""
+
+    def __init__(self, crs, node_xy, edge_u, edge_v, length_m, speed_kmh):
+        self.crs = CRS.from_user_input(crs)
+        self.node_xy = np.asarray(node_xy, dtype="float64")
+        self.edge_u = np.asarray(edge_u, dtype="int32")
+        self.edge_v = np.asarray(edge_v, dtype="int32")
+        self.length_m = np.asarray(length_m, dtype="float64")
+        self.speed_kmh = np.asarray(speed_kmh, dtype="float64")
+        self._segments = None
+        self._tree = None
+
+    @property
+    def n_nodes(self):
+        return len(self.node_xy)
+
+    @property
+    def n_edges(self):
+        return len(self.edge_u)
+
+    def weights(self, weight="length"):
+        """Edge cost: metres for ``"length"``, seconds for ``"time"``."""
+        if weight == "time":
+            return self.length_m / (self.speed_kmh / 3.6)
+        return self.length_m
+
+    def snap(self, points):
+        """Nearest edge, position along it (0 at ``edge_u``, 1 at ``edge_v``) and metres off the road, per point."""
+        if self._tree is None:
+            a, b = self.node_xy[self.edge_u], self.node_xy[self.edge_v]
+            self._segments = shapely.linestrings(np.stack([a, b], axis=1))
+            self._tree = shapely.STRtree(self._segments)
+        pts = points.to_crs(self.crs).values
+        (src, edge), offset = self._tree.query_nearest(pts, return_distance=True, all_matches=False)
+        order = np.argsort(src, kind="stable")
+        edge, offset = edge[order], offset[order]
+        t = shapely.line_locate_point(self._segments[edge], pts, normalized=True)
+        return edge, np.nan_to_num(t), offset
+
+    def nearest(self, sources, targets, weight="length"):
+        """Index of the nearest of ``sources`` and the cost to it, for each of ``targets`` (GeoSeries).
+
+        Each source becomes a virtual node joined to both ends of its snapped segment; one
+        multi-source Dijkstra run over those nodes labels every road node with its closest
+        source. Targets that no road connects to a source get index -1 and cost inf.
+        """
+        if not self.n_edges or sources.empty or targets.empty:
+            return np.full(len(targets), -1, dtype="int64"), np.full(len(targets), np.inf)
+        w = self.weights(weight)
+        offroad = (lambda m: m) if weight == "length" else (lambda m: m / (OFFROAD_KMH / 3.6))
+        s_edge, s_t, s_off = self.snap(sources)
+        roots = self.n_nodes + np.arange(len(s_edge))
+        start = offroad(s_off)
+        rows = np.concatenate([self.edge_u, roots, roots])
+        cols = np.concatenate([self.edge_v, self.edge_u[s_edge], self.edge_v[s_edge]])
+        data = np.concatenate([w, start + s_t * w[s_edge], start + (1 - s_t) * w[s_edge]])
+        size = self.n_nodes + len(roots)
+        graph = csr_matrix((np.maximum(data, _EPS), (rows, cols)), shape=(size, size))
+        dist, _, origin = dijkstra(graph, directed=False, indices=roots, min_only=True, return_predecessors=True)
+        t_edge, t_t, t_off = self.snap(targets)
+        ends = np.stack([self.edge_u[t_edge], self.edge_v[t_edge]])
+        cost = dist[ends] + np.stack([t_t, 1 - t_t]) * w[t_edge]
+        side = np.argmin(cost, axis=0)
+        cols = np.arange(len(t_edge))
+        best = cost[side, cols] + offroad(t_off)
+        idx = np.where(np.isfinite(best), origin[ends[side, cols]] - self.n_nodes, -1)
+        return idx.astype("int64"), best
+
+    def distances(self, sources, targets, weight="length"):
+        """Cost from the nearest of ``sources`` to each of ``targets``."""
+        return self.nearest(sources, targets, weight)[1]
+
+    def save(self, path):
+        np.savez_compressed(
+            path, crs=np.array(self.crs.to_wkt()), node_xy=self.node_xy, edge_u=self.edge_u,
+            edge_v=self.edge_v, length_m=self.length_m, speed_kmh=self.speed_kmh,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(str(z["crs"]), z["node_xy"], z["edge_u"], z["edge_v"], z["length_m"], z["speed_kmh"])
+
+
+def way_speeds(lines) -> np.ndarray:
+    """km/h per way from maxspeed, else DEFAULT_SPEEDS for its highway class."""
+    kmh = parse_maxspeed(tag_values(lines["tags"], "maxspeed"))
+    fallback = np.array([DEFAULT_SPEEDS.get(h, DEFAULT_SPEED) for h in tag_values(lines["tags"], "highway")], dtype="float64")
+    kmh = np.where(np.isnan(kmh) | (kmh <= 0), fallback, kmh)
+    return np.minimum(kmh, MAX_SPEED)
+
+
+def build_graph(lines) -> RoadGraph:
+    """RoadGraph from a line GeoDataFrame in EPSG:4326 with OSM ``tags``, one edge per vertex pair."""
+    crs = lines.estimate_utm_crs() if not lines.empty else CRS.from_epsg(3857)
+    if lines.empty:
+        return RoadGraph(crs, np.empty((0, 2)), [], [], [], [])
+    coords, way = shapely.get_coordinates(lines.geometry.values, return_index=True)
+    keys = (np.round((coords[:, 0] + 180) * COORD_SCALE).astype("int64") << 31) + np.round(
+        (coords[:, 1] + 90) * COORD_SCALE
+    ).astype("int64")
+    uniq, node = np.unique(keys, return_inverse=True)
+    first = np.zeros(len(uniq), dtype="int64")
+    first[node] = np.arange(len(node))  # any one vertex per node
+    lon, lat = coords[first, 0], coords[first, 1]
+    x, y = Transformer.from_crs("EPSG:4326", crs, always_xy=True).transform(lon, lat)
+    node_xy = np.column_stack([x, y])
+    same_way = way[1:] == way[:-1]
+    u, v = node[:-1][same_way], node[1:][same_way]
+    speed = way_speeds(lines)[way[:-1][same_way]]
+    keep = u != v
+    u, v, speed = np.minimum(u, v)[keep], np.maximum(u, v)[keep], speed[keep]
+    length = np.hypot(*(node_xy[u] - node_xy[v]).T)
+    # Parallel edges between the same pair of nodes: keep the shortest.
+    order = np.lexsort((length, v, u))
+    u, v, length, speed = u[order], v[order], length[order], speed[order]
+    first_edge = np.ones(len(u), dtype=bool)
+    first_edge[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+    return RoadGraph(crs, node_xy, u[first_edge], v[first_edge], length[first_edge], speed[first_edge])
+
+
+def load_network(bbox) -> RoadGraph:
+    """Road graph for ``bbox``, built from Overpass (or the offline store) and then read from disk.
+
+    Graph files expire after CACHE_TTL like the other cached Overpass results, so road edits are
+    picked up on the next rebuild.
+    """
+    os.makedirs(NETWORK_DIR, exist_ok=True)
+    path = os.path.join(NETWORK_DIR, cache_key("network", ",".join(f"{c:.6f}" for c in bbox)) + ".npz")
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) <= CACHE_TTL:
+        return RoadGraph.load(path)
+    lines = lines_by_key(bbox, "highway", filters=f'["highway"!~"{EXCLUDED_HIGHWAYS}"]')
+    graph = build_graph(lines)
+    tmp = path + ".tmp.npz"
+    graph.save(tmp)
+    os.replace(tmp, path)
+    return graph
+
+
+def network_nearest_facility(facilities: gpd.GeoDataFrame, villages: gpd.GeoDataFrame, bbox, graph=None):
+    """Like ``coverage.nearest_facility`` but along roads: (facility position, km) per village, -1/NaN if unreachable."""
+    graph = graph or load_network(bbox)
+    idx, m = graph.nearest(facilities.geometry, villages.geometry, weight="length")
+    return idx, np.where(np.isfinite(m), m / 1000.0, np.nan)
@@ -1,17 +1,186 @@
+import math
+import os
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
 import requests
 import geopandas as gpd
-from shapely.geometry import LineString
+import shapely
+
+from utils import http
+from utils.cache import cache_key, get_cache
+from utils.http import EndpointPool
+from utils.osmstore import get_store
+from utils.selectors import Clause, parse_selector, plan, render_selector
+from utils.stream import CHUNK_SIZE, ElementStream, blob_chunks
 
 OVERPASS = "https://overpass-api.de/api/interpreter"
+# Mirrors tried in order of health; override with a comma-separated MAPLAB_OVERPASS_URLS.
+OVERPASS_URLS = [
+    u.strip()
+    for u in os.environ.get(
+        "MAPLAB_OVERPASS_URLS", f"{OVERPASS},https://overpass.kumi.systems/api/interpreter"
+    ).split(",")
+    if u.strip()
+]
+OVERPASS_ENDPOINTS = EndpointPool(OVERPASS_URLS)
 UA = {"User-Agent": "MapLab30/1.0"}
 
+# Tiled mode is opt-in: set MAPLAB_TILE_DEG (tile edge in degrees) or pass tile_deg=... per call.
+TILE_DEG = float(os.environ.get("MAPLAB_TILE_DEG", 0))
+TILE_WORKERS = int(os.environ.get("MAPLAB_TILE_WORKERS", 2))
+TILE_MIN_DEG = 0.01
+LAYER_MARKER = "layer"
+CHANGED_SUFFIX = ":changed"  # marker of the created/modified block in a diff query
+
+
+class OverpassTimeout(RuntimeError):
+    """Overpass gave up on a query (HTTP 504/timeout or a 'runtime error' remark)."""
+
+
+def overpass_stream(query: str):
+    """ElementStream over an Overpass response, read incrementally from cache or network.
+
+    The body is teed into a zlib stream while it is parsed, so a cache write never
+    needs the raw JSON in memory. Partial (timed-out) results are not cached.
+    """
+    cache = get_cache()
+    key = cache_key("overpass", query)
+    blob = cache.get_blob(key)
+    if blob is not None:
+        return ElementStream(blob_chunks(blob))
+    r = http.request(
+        "POST",
+        OVERPASS_ENDPOINTS,
+        service="overpass",
+        data={"data": query},
+        headers={**UA, "Accept-Encoding": "gzip"},
+        timeout=60,
+        stream=True,
+    )
+    if not r.ok:
+        r.close()
+        r.raise_for_status()
+    packer = zlib.compressobj(6)
+    packed = []
+
+    def chunks():
+        with r:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                packed.append(packer.compress(chunk))
+                yield chunk
+
+    def store(meta):
+        # Overpass reports server-side timeouts as a 200 with a partial result and a remark.
+        if "runtime error" not in meta.get("remark", ""):
+            packed.append(packer.flush())
+            cache.put_blob(key, b"".join(packed))
+
+    return ElementStream(chunks(), on_complete=store)
+
 def overpass(query: str):
-    r = requests.post(OVERPASS, data={"data": query}, headers=UA, timeout=60)
-    r.raise_for_status()
-    return r.json()
+    stream = overpass_stream(query)
+    elements = list(stream)
+    return {**stream.meta, "elements": elements}
+
+def _query_elements(build, bbox, bases=None):
+    """Run one bbox query, raising OverpassTimeout instead of returning partial data.
+
+    ``bases``, if given, collects the response's ``osm_base`` timestamp.
+    """
+    try:
+        stream = overpass_stream(build(*bbox))
+    except requests.Timeout as exc:
+        raise OverpassTimeout(str(exc)) from exc
+    except requests.HTTPError as exc:
+        if exc.response is not None and exc.response.status_code == 504:
+            raise OverpassTimeout(str(exc)) from exc
+        raise
+    try:
+        elements = list(stream)
+    except (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as exc:
+        # A read timeout while the body streams in surfaces from iter_content as a
+        # ConnectionError (or a broken chunked encoding), not as requests.Timeout.
+        raise OverpassTimeout(str(exc)) from exc
+    remark = stream.meta.get("remark", "")
+    if "runtime error" in remark:
+        raise OverpassTimeout(remark)
+    if bases is not None:
+        bases.append(stream.meta.get("osm3s", {}).get("timestamp_osm_base"))
+    return elements
+
+def _grid(bbox, tile_deg):
+    s, w, n, e = bbox
+    rows = max(1, math.ceil((n - s) / tile_deg))
+    cols = max(1, math.ceil((e - w) / tile_deg))
+    dy, dx = (n - s) / rows, (e - w) / cols
+    return [
+        (s + i * dy, w + j * dx, s + (i + 1) * dy, w + (j + 1) * dx)
+        for i in range(rows)
+        for j in range(cols)
+    ]
+
+def _quarters(bbox):
+    s, w, n, e = bbox
+    my, mx = (s + n) / 2, (w + e) / 2
+    return [(s, w, my, mx), (s, mx, my, e), (my, w, n, mx), (my, mx, n, e)]
+
+def _dedupe(chunks):
+    """Concatenate element lists, keeping the first copy of each (type, id) per layer.
+
+    Layer markers from combined queries are always kept so the result can still be split.
+    """
+    seen = set()
+    out = []
+    for chunk in chunks:
+        layer = None
+        for el in chunk:
+            if el.get("type") == LAYER_MARKER:
+                layer = el.get("tags", {}).get("name")
+                out.append(el)
+                continue
+            ident = (layer, el.get("type"), el.get("id"))
+            if ident in seen:
+                continue
+            seen.add(ident)
+            out.append(el)
+    return out
+
+def _tiled_elements(build, bbox, tile_deg, bases=None):
+    """Fetch bbox as a grid of tiles on a bounded pool, quartering tiles that time out."""
+    chunks = []
+    with ThreadPoolExecutor(max_workers=TILE_WORKERS) as pool:
+        pending = {pool.submit(_query_elements, build, t, bases): t for t in _grid(bbox, tile_deg)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                tile = pending.pop(fut)
+                try:
+                    chunks.append(fut.result())
+                except OverpassTimeout:
+                    if tile[2] - tile[0] < 2 * TILE_MIN_DEG:
+                        raise
+                    for sub in _quarters(tile):
+                        pending[pool.submit(_query_elements, build, sub, bases)] = sub
+    return _dedupe(chunks)
+
+def _fetch_elements(build, bbox, tile_deg=None, bases=None):
+    """Elements for ``build(s, w, n, e)`` over bbox, tiled when a tile size is configured.
+
+    Untiled queries are streamed straight into the caller's builder, unless ``bases``
+    asks for the ``osm_base`` timestamp of every response (which is only known at the end).
+    """
+    tile_deg = TILE_DEG if tile_deg is None else tile_deg
+    if tile_deg:
+        return _tiled_elements(build, bbox, tile_deg, bases)
+    if bases is not None:
+        return _query_elements(build, bbox, bases)
+    return overpass_stream(build(*bbox))
 
 def _elements_to_gdf(elements, key_hint=None):
-    recs = []
+    """Point GeoDataFrame from Overpass elements, filled column-wise in a single pass."""
+    names, types, ids, lons, lats, tags_col = [], [], [], [], [], []
     for el in elements:
         if "lon" in el and "lat" in el:
             lon, lat = el["lon"], el["lat"]
@@ -19,80 +188,233 @@ def _elements_to_gdf(elements, key_hint=None):
             lon, lat = el["center"]["lon"], el["center"]["lat"]
         else:
             continue
-        recs.append({
-            "name": el.get("tags", {}).get("name", ""),
+        tags = el.get("tags", {})
+        names.append(tags.get("name", ""))
+        types.append(el.get("type", ""))
+        ids.append(el.get("id"))
+        lons.append(lon)
+        lats.append(lat)
+        tags_col.append(tags)
+    if not lons:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    lon = np.asarray(lons, dtype="float64")
+    lat = np.asarray(lats, dtype="float64")
+    return gpd.GeoDataFrame(
+        {
+            "name": names,
             "key": key_hint or "",
-            "type": el.get("type", ""),
+            "type": types,
+            "id": ids,
             "lon": lon,
             "lat": lat,
-            "tags": el.get("tags", {})
-        })
-    if not recs:
+            "tags": tags_col,
+        },
+        geometry=gpd.points_from_xy(lon, lat),
+        crs="EPSG:4326",
+    )
+
+def _ways_to_gdf(elements):
+    """Line GeoDataFrame from ``out geom`` ways, built from flat coordinate/offset arrays."""
+    ids, names, tags_col, counts, flat = [], [], [], [], []
+    for el in elements:
+        geom = el.get("geometry")
+        if not geom or len(geom) < 2:
+            continue
+        tags = el.get("tags", {})
+        ids.append(el.get("id"))
+        names.append(tags.get("name", ""))
+        tags_col.append(tags)
+        counts.append(len(geom))
+        for p in geom:
+            flat.append(p["lon"])
+            flat.append(p["lat"])
+    if not ids:
         return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    coords = np.asarray(flat, dtype="float64").reshape(-1, 2)
+    offsets = np.repeat(np.arange(len(counts)), counts)
     return gpd.GeoDataFrame(
-        recs,
-        geometry=gpd.points_from_xy([r["lon"] for r in recs], [r["lat"] for r in recs]),
+        {"id": ids, "name": names, "tags": tags_col},
+        geometry=shapely.linestrings(coords, indices=offsets),
         crs="EPSG:4326",
     )
 
-def pois_by_keyvalue(bbox, key, values_regex):
-    """Get points for a given OSM key and regex of values within bbox."""
-    s, w, n, e = bbox
-    q = f"""
+def _poly_filter(poly):
+    """Overpass ``poly:`` filter for a ``lat lon ...`` ring (see ``AOI.overpass_poly``), or nothing."""
+    return f'(poly:"{poly}")' if poly else ""
+
+def pois_by_keyvalue(bbox, key, values_regex, tile_deg=None, poly=None):
+    """Get points for a given OSM key and regex of values within bbox (and ``poly``, if given)."""
+    def build(s, w, n, e):
+        return f"""
     [out:json][timeout:25];
-    (
-      node["{key}"~"{values_regex}"]({s},{w},{n},{e});
-      way["{key}"~"{values_regex}"]({s},{w},{n},{e});
-      relation["{key}"~"{values_regex}"]({s},{w},{n},{e});
-    );
+    nwr["{key}"~"{values_regex}"]({s},{w},{n},{e}){_poly_filter(poly)};
     out center tags;
     """
-    js = overpass(q)
-    return _elements_to_gdf(js.get("elements", []), key_hint=key)
+    store = get_store()
+    if store is not None:
+        return _elements_to_gdf(store.query([f'["{key}"~"{values_regex}"]'], bbox), key_hint=key)
+    return _elements_to_gdf(_fetch_elements(build, bbox, tile_deg), key_hint=key)
 
-def pois_by_selectors(bbox, selectors):
-    """Get points for a set of raw Overpass tag selectors."""
+def pois_by_selectors(bbox, selectors, tile_deg=None, poly=None):
+    """Get points for a set of raw Overpass tag selectors (merged by the query planner)."""
     if not selectors:
         return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
-    s, w, n, e = bbox
-    body_lines = []
-    for sel in selectors:
-        body_lines.extend([
-            f"  node{sel}({s},{w},{n},{e});",
-            f"  way{sel}({s},{w},{n},{e});",
-            f"  relation{sel}({s},{w},{n},{e});",
-        ])
-    body = "\n".join(body_lines)
-    q = f"""
+    query_plan = plan(selectors)
+    def build(s, w, n, e):
+        body = "\n".join(f"  {st}" for st in query_plan.statements(f"{s},{w},{n},{e}", _poly_filter(poly)))
+        return f"""
     [out:json][timeout:30];
     (
 {body}
     );
     out center tags;
     """
-    js = overpass(q)
-    return _elements_to_gdf(js.get("elements", []))
+    store = get_store()
+    if store is not None:
+        return _elements_to_gdf(store.query(query_plan.selectors, bbox))
+    return _elements_to_gdf(_fetch_elements(build, bbox, tile_deg))
 
-def lines_by_key(bbox, key, extra_filter=""):
-    """Get line features by key within bbox; optional extra filter clause."""
-    s, w, n, e = bbox
-    q = f"""
+def lines_by_key(bbox, key, filters="", tile_deg=None, poly=None):
+    """Get line features by key within bbox (and ``poly``, if given).
+
+    ``filters`` are further tag clauses the ways must pass, e.g. ``'["highway"!~"proposed"]'``.
+    """
+    selector = render_selector([Clause(key, "has"), *parse_selector(filters)])
+    def build(s, w, n, e):
+        return f"""
     [out:json][timeout:25];
-    way["{key}"{extra_filter}]({s},{w},{n},{e});
+    way{selector}({s},{w},{n},{e}){_poly_filter(poly)};
     out tags geom;
     """
-    js = overpass(q)
-    recs = []
-    for el in js.get("elements", []):
-        if "geometry" not in el:
-            continue
-        coords = [(p["lon"], p["lat"]) for p in el["geometry"]]
-        recs.append({
-            "id": el.get("id"),
-            "name": el.get("tags", {}).get("name", ""),
-            "tags": el.get("tags", {}),
-            "geometry": LineString(coords)
-        })
-    if not recs:
-        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
-    return gpd.GeoDataFrame(recs, crs="EPSG:4326")
+    store = get_store()
+    if store is not None:
+        return _ways_to_gdf(store.query([selector], bbox, types=("way",), geometry=True))
+    return _ways_to_gdf(_fetch_elements(build, bbox, tile_deg))
+
+def _split_layers(elements, names):
+    """Group a combined response by the ``make layer`` markers that precede each output block."""
+    layers = {name: [] for name in names}
+    current = None
+    for el in elements:
+        if el.get("type") == LAYER_MARKER:
+            current = layers.get(el.get("tags", {}).get("name"))
+        elif current is not None:
+            current.append(el)
+    return layers
+
+def _layers_query(plans, s, w, n, e, poly=None, since=None):
+    """Combined query for ``plans``; with ``since``, each layer's ids plus only the objects newer than it."""
+    blocks, outs = [], []
+    for i, (name, query_plan) in enumerate(plans.items()):
+        body = "\n".join(f"  {st}" for st in query_plan.statements(f"{s},{w},{n},{e}", _poly_filter(poly)))
+        blocks.append(f"(\n{body}\n)->.l{i};")
+        if since is None:
+            outs.append(f'make {LAYER_MARKER} name="{name}"; out;\n.l{i} out center tags;')
+        else:
+            outs.append(
+                f'make {LAYER_MARKER} name="{name}"; out;\n.l{i} out ids;\n'
+                f'nwr.l{i}(newer:"{since}")->.c{i};\n'
+                f'make {LAYER_MARKER} name="{name}{CHANGED_SUFFIX}"; out;\n.c{i} out center tags;'
+            )
+    return "[out:json][timeout:30];\n" + "\n".join(blocks) + "\n" + "\n".join(outs) + "\n"
+
+def explain_layers(bbox, layers, poly=None):
+    """(query, planned cost, naive cost) of the combined request layers_by_selectors would send."""
+    plans = {name: plan(selectors) for name, selectors in layers.items() if selectors}
+    return (
+        _layers_query(plans, *bbox, poly=poly),
+        sum(p.cost for p in plans.values()),
+        sum(p.naive_cost for p in plans.values()),
+    )
+
+def _oldest(bases):
+    """Oldest ``osm_base`` of a (possibly tiled) fetch, so the next diff misses nothing; None if unknown."""
+    bases = [b for b in bases if b]
+    return min(bases) if bases else None
+
+def element_key(el) -> str:
+    """``"node/123"``-style identity of an Overpass element."""
+    return f"{el.get('type')}/{el.get('id')}"
+
+def osm_keys(gdf):
+    """``element_key`` for every row of a GeoDataFrame built from Overpass elements."""
+    return gdf["type"].astype(str) + "/" + gdf["id"].astype(str)
+
+def layer_elements(bbox, layers, tile_deg=None, poly=None):
+    """Raw elements per layer for the combined request, and the ``osm_base`` they reflect.
+
+    The timestamp is None when answering from the offline store.
+    """
+    plans = {name: plan(selectors) for name, selectors in layers.items() if selectors}
+    if not plans:
+        return {name: [] for name in layers}, None
+    store = get_store()
+    if store is not None:
+        split = {name: store.query(p.selectors, bbox) for name, p in plans.items()}
+        return {name: split.get(name, []) for name in layers}, None
+    def build(s, w, n, e):
+        return _layers_query(plans, s, w, n, e, poly)
+    bases = []
+    split = _split_layers(_fetch_elements(build, bbox, tile_deg, bases), list(plans))
+    return {name: split.get(name, []) for name in layers}, _oldest(bases)
+
+def layer_changes(bbox, layers, since, tile_deg=None, poly=None):
+    """What changed in each layer since the ``osm_base`` timestamp ``since``.
+
+    Returns ``(current, changed, osm_base)``: the keys of every object that matches now
+    (anything missing from it was deleted or no longer matches), the full elements of
+    those created or modified after ``since``, and the new ``osm_base``. The ids cost a
+    few bytes per object instead of its tags and position.
+    """
+    plans = {name: plan(selectors) for name, selectors in layers.items() if selectors}
+    if not plans:
+        return {name: set() for name in layers}, {name: [] for name in layers}, since
+    def build(s, w, n, e):
+        return _layers_query(plans, s, w, n, e, poly, since)
+    bases = []
+    names = [*plans, *(name + CHANGED_SUFFIX for name in plans)]
+    split = _split_layers(_fetch_elements(build, bbox, tile_deg, bases), names)
+    current = {name: {element_key(el) for el in split.get(name, [])} for name in layers}
+    changed = {name: split.get(name + CHANGED_SUFFIX, []) for name in layers}
+    return current, changed, _oldest(bases) or since
+
+def elements_by_key(keys):
+    """Current tags and centre of the objects named by ``element_key`` strings, in one request."""
+    ids = {"node": [], "way": [], "relation": []}
+    for key in keys:
+        osm_type, _, osm_id = key.partition("/")
+        ids[osm_type].append(osm_id)
+    statements = "".join(f"{t}(id:{','.join(v)});" for t, v in ids.items() if v)
+    if not statements:
+        return []
+    query = f"[out:json][timeout:30];\n({statements});\nout center tags;\n"
+    return _query_elements(lambda: query, ())
+
+def layers_to_gdfs(split, names, key_hints=None):
+    """One point GeoDataFrame per layer name from ``layer_elements``-style raw elements."""
+    key_hints = key_hints or {}
+    return {
+        name: _elements_to_gdf(split.get(name, []), key_hint=key_hints.get(name))
+        if split.get(name) else gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+        for name in names
+    }
+
+def layers_by_selectors(bbox, layers, key_hints=None, tile_deg=None, poly=None):
+    """Fetch several named selector sets in one Overpass request.
+
+    ``layers`` maps a layer name to its raw tag selectors. Each set is planned into
+    ``nwr`` statements, collected into its own Overpass set variable and printed after
+    a marker element, so the single response is split back into one point GeoDataFrame
+    per layer.
+    """
+    plans = {name: plan(selectors) for name, selectors in layers.items() if selectors}
+    if not plans:
+        return layers_to_gdfs({}, layers)
+    def build(s, w, n, e):
+        return _layers_query(plans, s, w, n, e, poly)
+    store = get_store()
+    if store is not None:
+        split = {name: store.query(p.selectors, bbox) for name, p in plans.items()}
+    else:
+        split = _split_layers(_fetch_elements(build, bbox, tile_deg), list(plans))
+    return layers_to_gdfs(split, layers, key_hints)
@@ -0,0 +1,360 @@
+"""Local OSM extract store, so the app can answer tag/bbox queries without Overpass.
+
+Ingest a .osm(.gz/.bz2) XML or .osm.pbf extract once, then point the app at it:
+    python -m utils.osmstore ingest india-latest.osm.pbf --out india.sqlite
+    MAPLAB_OSM_STORE=india.sqlite streamlit run Home.py
+"""
+import argparse
+import bz2
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from utils.selectors import Clause, parse_selector
+
+OSM_STORE = os.environ.get("MAPLAB_OSM_STORE", "")
+BATCH = 5_000
+SQL_VARS = 500  # ids per "IN (...)" lookup, well below SQLite's variable limit
+
+_SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS features (
+    id INTEGER PRIMARY KEY,
+    osm_type TEXT NOT NULL,
+    osm_id INTEGER NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    tags TEXT NOT NULL,
+    geom BLOB
+);
+CREATE UNIQUE INDEX IF NOT EXISTS features_osm ON features (osm_type, osm_id);
+CREATE TABLE IF NOT EXISTS tags (
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    feature_id INTEGER NOT NULL,
+    PRIMARY KEY (key, value, feature_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_feature ON tags (feature_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS features_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat);
+"""
+
+
+def _unescape(value: str) -> str:
+    """Text of an Overpass string literal (``\\"`` and ``\\\\`` escapes resolved)."""
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+def _clause_test(clause: Clause):
+    """Python predicate over a tags dict with Overpass semantics for one clause."""
+    key, value = clause.key, _unescape(clause.value)
+    if clause.op == "has":
+        return lambda tags: key in tags
+    if clause.op == "not":
+        return lambda tags: key not in tags
+    if clause.op == "=":
+        return lambda tags: tags.get(key) == value
+    if clause.op == "!=":
+        return lambda tags: tags.get(key) != value
+    pattern = re.compile(value, re.I if clause.icase else 0)
+    if clause.op == "~":
+        return lambda tags: key in tags and pattern.search(tags[key]) is not None
+    return lambda tags: key not in tags or pattern.search(tags[key]) is None
+
+
+def _open_xml(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_xml(path):
+    """Yield ("node", id, lat, lon, tags), ("way", id, refs, tags) and ("relation", id, members, tags)."""
+    with _open_xml(path) as fh:
+        context = ET.iterparse(fh, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event != "end" or elem.tag not in ("node", "way", "relation"):
+                continue
+            tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            osm_id = int(elem.get("id"))
+            if elem.tag == "node":
+                yield "node", osm_id, float(elem.get("lat")), float(elem.get("lon")), tags
+            elif elem.tag == "way":
+                yield "way", osm_id, [int(nd.get("ref")) for nd in elem.iter("nd")], tags
+            else:
+                members = [(m.get("type"), int(m.get("ref"))) for m in elem.iter("member")]
+                yield "relation", osm_id, members, tags
+            root.clear()
+
+
+def read_pbf(path):
+    """Same records as read_xml from a PBF extract (needs the optional ``osmium`` package)."""
+    try:
+        import osmium
+    except ImportError as exc:
+        raise RuntimeError("Reading .pbf extracts needs pyosmium: pip install osmium") from exc
+    for obj in osmium.FileProcessor(path):
+        tags = {t.k: t.v for t in obj.tags}
+        if obj.is_node():
+            if obj.location.valid():
+                yield "node", obj.id, obj.location.lat, obj.location.lon, tags
+        elif obj.is_way():
+            yield "way", obj.id, [n.ref for n in obj.nodes], tags
+        elif obj.is_relation():
+            types = {"n": "node", "w": "way", "r": "relation"}
+            yield "relation", obj.id, [(types.get(m.type), m.ref) for m in obj.members], tags
+
+
+class OsmStore:
+    """SQLite store of tagged OSM features with a tag index and an R-tree over their extents."""
+
+    def __init__(self, path=OSM_STORE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+
+    # -- ingestion -------------------------------------------------------
+
+    def ingest(self, path, progress=None):
+        """Stream an extract into the store; memory stays bounded by BATCH, not by file size.
+
+        Node coordinates and way extents go to a scratch database next to the store so ways
+        and relations can be resolved without holding the extract in memory.
+        """
+        reader = read_pbf if path.endswith(".pbf") else read_xml
+        scratch = self.path + ".scratch"
+        if os.path.exists(scratch):
+            os.remove(scratch)
+        db = self._db
+        db.execute("ATTACH DATABASE ? AS scratch", (scratch,))
+        counts = {"node": 0, "way": 0, "relation": 0, "features": 0}
+        try:
+            db.executescript(
+                """
+                PRAGMA scratch.journal_mode=OFF;
+                PRAGMA scratch.synchronous=OFF;
+                CREATE TABLE scratch.coords (id INTEGER PRIMARY KEY, lat REAL, lon REAL);
+                CREATE TABLE scratch.way_extent (id INTEGER PRIMARY KEY, s REAL, w REAL, n REAL, e REAL);
+                """
+            )
+            db.execute("BEGIN")
+            kind, batch = None, []
+            for record in reader(path):
+                # Extracts list nodes, then ways, then relations: flush whenever the kind
+                # changes so every way sees all node coordinates written before it.
+                if record[0] != kind or len(batch) >= BATCH:
+                    counts["features"] += self._flush(kind, batch)
+                    kind, batch = record[0], []
+                    if progress:
+                        progress(counts)
+                counts[kind] += 1
+                batch.append(record)
+            counts["features"] += self._flush(kind, batch)
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('source', ?), ('ingested', ?)",
+                (os.path.abspath(path), time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())),
+            )
+            db.execute("COMMIT")
+        except Exception:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.execute("DETACH DATABASE scratch")
+            os.remove(scratch)
+        return counts
+
+    def _coords(self, table, cols, ids):
+        found = {}
+        ids = list(ids)
+        for i in range(0, len(ids), SQL_VARS):
+            chunk = ids[i:i + SQL_VARS]
+            marks = ",".join("?" * len(chunk))
+            for row in self._db.execute(f"SELECT id, {cols} FROM scratch.{table} WHERE id IN ({marks})", chunk):
+                found[row[0]] = row[1:]
+        return found
+
+    def _insert(self, osm_type, osm_id, lat, lon, tags, extent, geom=None):
+        """Insert or replace one feature together with its tag rows and R-tree entry."""
+        tags_json = json.dumps(tags, ensure_ascii=False)
+        row = self._db.execute(
+            "SELECT id FROM features WHERE osm_type = ? AND osm_id = ?", (osm_type, osm_id)
+        ).fetchone()
+        if row:
+            fid = row[0]
+            self._db.execute(
+                "UPDATE features SET lat = ?, lon = ?, tags = ?, geom = ? WHERE id = ?",
+                (lat, lon, tags_json, geom, fid),
+            )
+            self._db.execute("DELETE FROM tags WHERE feature_id = ?", (fid,))
+        else:
+            fid = self._db.execute(
+                "INSERT INTO features (osm_type, osm_id, lat, lon, tags, geom) VALUES (?, ?, ?, ?, ?, ?)",
+                (osm_type, osm_id, lat, lon, tags_json, geom),
+            ).lastrowid
+        s, w, n, e = extent
+        self._db.execute("INSERT OR REPLACE INTO features_rtree VALUES (?, ?, ?, ?, ?)", (fid, w, e, s, n))
+        self._db.executemany(
+            "INSERT OR IGNORE INTO tags (key, value, feature_id) VALUES (?, ?, ?)",
+            [(k, v, fid) for k, v in tags.items()],
+        )
+
+    def _flush(self, kind, records):
+        if not records:
+            return 0
+        db, stored = self._db, 0
+        if kind == "node":
+            db.executemany("INSERT OR REPLACE INTO scratch.coords VALUES (?, ?, ?)", [r[1:4] for r in records])
+            for _, osm_id, lat, lon, tags in records:
+                if tags:
+                    self._insert("node", osm_id, lat, lon, tags, (lat, lon, lat, lon))
+                    stored += 1
+        elif kind == "way":
+            coords = self._coords("coords", "lat, lon", {ref for r in records for ref in r[2]})
+            extents = []
+            for _, osm_id, refs, tags in records:
+                pts = np.array([coords[ref] for ref in refs if ref in coords], dtype="float64").reshape(-1, 2)
+                if not len(pts):
+                    continue
+                (s, w), (n, e) = pts.min(axis=0), pts.max(axis=0)
+                extents.append((osm_id, s, w, n, e))
+                if tags:
+                    # Overpass "out center" uses the centre of the bounding box.
+                    geom = np.ascontiguousarray(pts[:, ::-1]).tobytes()
+                    self._insert("way", osm_id, (s + n) / 2, (w + e) / 2, tags, (s, w, n, e), geom)
+                    stored += 1
+            db.executemany("INSERT OR REPLACE INTO scratch.way_extent VALUES (?, ?, ?, ?, ?)", extents)
+        else:
+            nodes = self._coords("coords", "lat, lon", {ref for r in records for t, ref in r[2] if t == "node"})
+            ways = self._coords("way_extent", "s, w, n, e", {ref for r in records for t, ref in r[2] if t == "way"})
+            for _, osm_id, members, tags in records:
+                if not tags:
+                    continue
+                boxes = [nodes[ref] * 2 for t, ref in members if t == "node" and ref in nodes]
+                boxes += [ways[ref] for t, ref in members if t == "way" and ref in ways]
+                if not boxes:
+                    continue
+                arr = np.asarray(boxes, dtype="float64")
+                s, w = arr[:, 0].min(), arr[:, 1].min()
+                n, e = arr[:, 2].max(), arr[:, 3].max()
+                self._insert("relation", osm_id, (s + n) / 2, (w + e) / 2, tags, (s, w, n, e))
+                stored += 1
+        return stored
+
+    # -- queries ---------------------------------------------------------
+
+    def _candidates(self, clause: Clause, bbox):
+        """Feature rows in bbox that pass the clause the tag index can answer."""
+        s, w, n, e = bbox
+        sql = (
+            "SELECT f.id, f.osm_type, f.osm_id, f.lat, f.lon, f.tags, f.geom FROM features_rtree r"
+            " JOIN features f ON f.id = r.id"
+        )
+        where = "r.min_lon <= ? AND r.max_lon >= ? AND r.min_lat <= ? AND r.max_lat >= ?"
+        params = [e, w, n, s]
+        if clause is not None and clause.op in ("=", "~", "has"):
+            sql += " JOIN tags t ON t.feature_id = f.id"
+            where += " AND t.key = ?"
+            params.append(clause.key)
+            if clause.op == "=":
+                where += " AND t.value = ?"
+                params.append(_unescape(clause.value))
+        return self._db.execute(f"{sql} WHERE {where}", params)
+
+    def query(self, selectors, bbox, types=("node", "way", "relation"), geometry=False):
+        """Overpass-style elements matching any selector within bbox (south, west, north, east).
+
+        Nodes carry lat/lon, ways and relations a ``center`` (or, with ``geometry=True``,
+        ways their full ``geometry``), so the results feed the same GeoDataFrame builders
+        as live Overpass responses.
+        """
+        seen, out = set(), []
+        with self._lock:
+            for selector in selectors:
+                clauses = sorted(parse_selector(selector), key=Clause.cost)
+                tests = [_clause_test(c) for c in clauses]
+                for fid, osm_type, osm_id, lat, lon, tags_json, geom in self._candidates(
+                    clauses[0] if clauses else None, bbox
+                ):
+                    if fid in seen or osm_type not in types:
+                        continue
+                    tags = json.loads(tags_json)
+                    if not all(test(tags) for test in tests):
+                        continue
+                    seen.add(fid)
+                    if osm_type == "node":
+                        out.append({"type": "node", "id": osm_id, "lat": lat, "lon": lon, "tags": tags})
+                    elif geometry and geom is not None:
+                        pts = np.frombuffer(geom, dtype="float64").reshape(-1, 2)
+                        out.append({
+                            "type": osm_type, "id": osm_id, "tags": tags,
+                            "geometry": [{"lon": x, "lat": y} for x, y in pts.tolist()],
+                        })
+                    else:
+                        out.append({"type": osm_type, "id": osm_id, "center": {"lat": lat, "lon": lon}, "tags": tags})
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT osm_type, COUNT(*) FROM features GROUP BY osm_type").fetchall())
+            meta = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+        return {**meta, **counts}
+
+
+_default = None
+_default_pid = None
+_default_lock = threading.Lock()
+
+
+def get_store():
+    """The store named by MAPLAB_OSM_STORE, or None when the app should use Overpass."""
+    global _default, _default_pid
+    if not OSM_STORE:
+        return None
+    with _default_lock:
+        if _default is None or _default_pid != os.getpid():
+            _default, _default_pid = OsmStore(OSM_STORE), os.getpid()
+        return _default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a local OSM extract store.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    ingest = sub.add_parser("ingest", help="Load a .osm, .osm.gz, .osm.bz2 or .osm.pbf extract.")
+    ingest.add_argument("path")
+    ingest.add_argument("--out", default=OSM_STORE or "osm.sqlite", help="Store file (default: $MAPLAB_OSM_STORE).")
+    query = sub.add_parser("query", help="Count features matching selectors in a bbox.")
+    query.add_argument("bbox", help="south,west,north,east")
+    query.add_argument("selectors", nargs="+")
+    query.add_argument("--store", default=OSM_STORE or "osm.sqlite")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "ingest":
+        started = time.time()
+        def progress(c):
+            print(f"\r{c['node']:,} nodes, {c['way']:,} ways, {c['relation']:,} relations", end="", file=sys.stderr)
+        counts = OsmStore(args.out).ingest(args.path, progress)
+        print(f"\n{counts['features']:,} tagged features stored in {args.out} ({time.time() - started:.0f}s)")
+    else:
+        bbox = tuple(float(v) for v in args.bbox.split(","))
+        started = time.time()
+        elements = OsmStore(args.store).query(args.selectors, bbox)
+        print(f"{len(elements)} features ({(time.time() - started) * 1000:.1f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Slimmer vector payloads for the map: zoom-aware simplification, ~1 m coordinates, optional TopoJSON."""
+import json
+import math
+import os
+from typing import NamedTuple
+
+import numpy as np
+import shapely
+
+QUANTIZE_DECIMALS = 5  # 1e-5° ≈ 1.1 m
+PIXEL_TOLERANCE = 0.5  # simplify away detail smaller than half a screen pixel
+ZOOM_HEADROOM = 2  # keep enough vertices to zoom in this many levels past the initial view
+MAP_PIXELS = 800  # viewport size assumed when deriving a zoom from a bbox
+TOPOJSON_SCALE = 10 ** QUANTIZE_DECIMALS
+PAYLOAD_FORMAT = os.environ.get("MAPLAB_PAYLOAD_FORMAT", "geojson")  # or "topojson"
+
+
+class Payload(NamedTuple):
+    data: dict
+    fmt: str  # "geojson" or "topojson"
+    raw_bytes: int
+    bytes: int
+
+    @property
+    def ratio(self) -> float:
+        return self.raw_bytes / self.bytes if self.bytes else 1.0
+
+
+def fit_zoom(bbox, pixels=MAP_PIXELS) -> int:
+    """Web-map zoom at which ``bbox`` (south, west, north, east) fills about ``pixels`` pixels."""
+    south, west, north, east = bbox
+    span = max(east - west, (north - south) / max(math.cos(math.radians((north + south) / 2)), 0.1), 1e-6)
+    return int(max(0, min(18, math.floor(math.log2(360 * pixels / (256 * span))))))
+
+
+def tolerance_deg(zoom: float, pixels: float = PIXEL_TOLERANCE) -> float:
+    """Degrees covered by ``pixels`` screen pixels at ``zoom`` (at the equator; smaller elsewhere)."""
+    return pixels * 360.0 / (256 * 2 ** (zoom + ZOOM_HEADROOM))
+
+
+def reduce_geometries(geoms, zoom: float):
+    """Topology-preserving simplification for ``zoom``, then coordinates snapped to QUANTIZE_DECIMALS."""
+    geoms = shapely.simplify(np.asarray(geoms), tolerance_deg(zoom), preserve_topology=True)
+    return shapely.transform(geoms, lambda xy: np.round(xy, QUANTIZE_DECIMALS))
+
+
+def _records(gdf, properties):
+    if not properties:
+        return [{} for _ in range(len(gdf))]
+    table = gdf[list(properties)].astype(object)
+    return table.where(table.notna(), None).to_dict("records")
+
+
+def _size(data) -> int:
+    """Bytes as embedded in the map page (folium serialises with the default separators)."""
+    return len(json.dumps(data))
+
+
+def _encode_arc(xy, arcs):
+    """Append one quantised, delta-encoded arc and return its index."""
+    q = np.round(np.asarray(xy) * TOPOJSON_SCALE).astype("int64")
+    q = np.vstack([q[:1], np.diff(q, axis=0)])
+    arcs.append(q.tolist())
+    return len(arcs) - 1
+
+
+def _topo_geometry(geom, arcs):
+    kind = geom.geom_type
+    if kind == "Point":
+        # Quantised with the same transform as arcs, but not delta-encoded.
+        return {"type": "Point", "coordinates": [round(geom.x * TOPOJSON_SCALE), round(geom.y * TOPOJSON_SCALE)]}
+    if kind == "LineString":
+        return {"type": "LineString", "arcs": [_encode_arc(geom.coords, arcs)]}
+    if kind == "Polygon":
+        rings = [geom.exterior, *geom.interiors]
+        return {"type": "Polygon", "arcs": [[_encode_arc(r.coords, arcs)] for r in rings]}
+    if kind == "MultiLineString":
+        return {"type": "MultiLineString", "arcs": [[_encode_arc(g.coords, arcs)] for g in geom.geoms]}
+    if kind == "MultiPolygon":
+        parts = [_topo_geometry(g, arcs)["arcs"] for g in geom.geoms]
+        return {"type": "MultiPolygon", "arcs": parts}
+    return {"type": "GeometryCollection", "geometries": [_topo_geometry(g, arcs) for g in geom.geoms]}
+
+
+def to_topojson(geoms, properties, name="layer") -> dict:
+    """TopoJSON topology with one quantised arc per ring/line (arcs are not shared between features)."""
+    arcs = []
+    geometries = []
+    for geom, props in zip(geoms, properties):
+        g = _topo_geometry(geom, arcs)
+        g["properties"] = props
+        geometries.append(g)
+    return {
+        "type": "Topology",
+        "transform": {"scale": [1 / TOPOJSON_SCALE, 1 / TOPOJSON_SCALE], "translate": [0, 0]},
+        "objects": {name: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": arcs,
+    }
+
+
+def build_payload(gdf, zoom: float, properties=(), topojson=False, name="layer") -> Payload:
+    """Reduced GeoJSON (or TopoJSON) for ``gdf`` in EPSG:4326, with before/after sizes in bytes."""
+    properties = [p for p in properties if p in gdf.columns]
+    raw = gdf[[*properties, gdf.geometry.name]].to_geo_dict(drop_id=True)
+    geoms = reduce_geometries(gdf.geometry.values, zoom)
+    keep = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    geoms, props = geoms[keep], [p for p, k in zip(_records(gdf, properties), keep) if k]
+    if topojson:
+        data, fmt = to_topojson(geoms, props, name), "topojson"
+    else:
+        features = [{"type": "Feature", "properties": p, "geometry": g.__geo_interface__} for g, p in zip(geoms, props)]
+        data, fmt = {"type": "FeatureCollection", "features": features}, "geojson"
+    return Payload(data, fmt, _size(raw), _size(data))
+
+
+def describe_sizes(payloads) -> str:
+    """One-line before/after summary, e.g. ``vector layers 812 KB → 63 KB (12.9× smaller)``."""
+    raw = sum(p.raw_bytes for p in payloads)
+    reduced = sum(p.bytes for p in payloads)
+    ratio = raw / reduced if reduced else 1.0
+    return f"vector layers {raw / 1024:,.1f} KB → {reduced / 1024:,.1f} KB ({ratio:.1f}× smaller)"
@@ -0,0 +1,82 @@
+"""Named, memoised stages so a Streamlit rerun only recomputes what its inputs changed.
+
+Stages are declared with the inputs they read, either parameters or other stages:
+
+    pipeline = Pipeline()
+
+    @pipeline.stage("bbox", inputs=("area",))
+    def _bbox(area): ...
+
+    pipeline.run("bbox", {"area": "Ranchi"}, memo)
+
+A stage's fingerprint hashes its name with the fingerprints of its inputs, so changing
+one parameter invalidates exactly the stages downstream of it. Results live in a Memo,
+typically kept in ``st.session_state`` so each browser session has its own.
+"""
+import hashlib
+from collections import OrderedDict
+
+
+class Memo(OrderedDict):
+    """LRU map of stage fingerprint to result, with hit/miss counters."""
+
+    def __init__(self, max_entries=64):
+        super().__init__()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+
+
+def _param_fingerprint(name, value) -> str:
+    return hashlib.sha1(f"{name}={value!r}".encode("utf-8")).hexdigest()
+
+
+class Pipeline:
+    """A DAG of stages evaluated lazily, on demand, against a Memo."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def stage(self, name, inputs=()):
+        """Register ``func(**inputs)`` as stage ``name``; inputs name parameters or earlier stages."""
+        def register(func):
+            if name in inputs:
+                raise ValueError(f"Stage {name!r} cannot depend on itself")
+            self.stages[name] = (func, tuple(inputs))
+            return func
+        return register
+
+    def fingerprint(self, name, params, _seen=None) -> str:
+        seen = {} if _seen is None else _seen
+        if name in seen:
+            return seen[name]
+        if name not in self.stages:
+            if name not in params:
+                raise KeyError(f"Unknown stage or parameter {name!r}")
+            fp = _param_fingerprint(name, params[name])
+        else:
+            parts = [name] + [self.fingerprint(i, params, seen) for i in self.stages[name][1]]
+            fp = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+        seen[name] = fp
+        return fp
+
+    def run(self, name, params, memo: Memo, _seen=None):
+        """Value of stage ``name``, reusing memoised upstream results wherever they are still valid."""
+        seen = {} if _seen is None else _seen
+        fp = self.fingerprint(name, params, seen)
+        if fp in memo:
+            memo.hits += 1
+            memo.move_to_end(fp)
+            return memo[fp]
+        memo.misses += 1
+        func, inputs = self.stages[name]
+        args = {i: self.run(i, params, memo, seen) if i in self.stages else params[i] for i in inputs}
+        value = func(**args)
+        memo.put(fp, value)
+        return value
@@ -0,0 +1,37 @@
+import multiprocessing
+import time
+
+
+class RateLimiter:
+    """Space calls at least ``1 / per_second`` apart.
+
+    The schedule lives in a ``multiprocessing.Value``, so a limiter handed to worker
+    processes (e.g. via a pool initializer) enforces one global rate across all of them.
+    """
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second
+        self._next = multiprocessing.Value("d", 0.0)
+
+    def wait(self):
+        with self._next.get_lock():
+            now = time.time()
+            slot = max(now, self._next.value)
+            self._next.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_LIMITERS = {}
+
+
+def set_rate_limits(limiters: dict):
+    """Install limiters by service name ("overpass", "nominatim") for this process."""
+    _LIMITERS.clear()
+    _LIMITERS.update(limiters)
+
+
+def throttle(service: str):
+    limiter = _LIMITERS.get(service)
+    if limiter is not None:
+        limiter.wait()
@@ -0,0 +1,172 @@
+"""Map layers that stay light in the browser however many features there are."""
+import html
+import json
+import os
+
+import numpy as np
+import folium
+from folium.map import Layer
+from folium.plugins import FastMarkerCluster, VectorGridProtobuf
+from folium.template import Template
+
+from utils.payload import PAYLOAD_FORMAT, build_payload
+
+# Up to this many points per layer keep leafmap's individual icon markers; above it points
+# are drawn as one canvas circle-marker layer (or a client-side cluster, see POINT_MODE).
+MARKER_LIMIT = int(os.environ.get("MAPLAB_MARKER_LIMIT", 300))
+POINT_MODE = os.environ.get("MAPLAB_POINT_MODE", "canvas")  # "canvas" or "cluster"
+COORD_DECIMALS = 5  # ~1 m, far below what a marker can show
+
+_CLUSTER_CALLBACK = """
+function (row) {
+    var fields = %(fields)s;
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: %(radius)s, color: "%(color)s", weight: 1, fillColor: "%(color)s", fillOpacity: 0.85});
+    if (fields.length) {
+        marker.bindPopup(fields.map(function (f, i) { return "<b>" + f + "</b>: " + row[i + 2]; }).join("<br>"));
+    }
+    return marker;
+}
+"""
+
+
+def _rows(gdf, x, y, popup):
+    """``[lat, lon, *escaped popup values]`` per point, coordinates rounded to COORD_DECIMALS."""
+    lat = np.round(gdf[y].to_numpy(dtype="float64"), COORD_DECIMALS).tolist()
+    lon = np.round(gdf[x].to_numpy(dtype="float64"), COORD_DECIMALS).tolist()
+    values = [[html.escape(v) for v in gdf[f].astype(str)] for f in popup]
+    return [[lat[i], lon[i], *(col[i] for col in values)] for i in range(len(lat))]
+
+
+class CanvasPoints(Layer):
+    """Circle markers on one shared canvas renderer, shipped as a compact array of rows.
+
+    Each row is ``[lat, lon, *popup values]``; markers and popups are created in the
+    browser, so the page carries a few dozen bytes per point instead of a Marker with
+    its own HTML and JavaScript.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function () {
+                var rows = {{ this.rows }};
+                var fields = {{ this.fields }};
+                var group = L.featureGroup();
+                var renderer = L.canvas({padding: 0.5});
+                var style = {renderer: renderer, radius: {{ this.radius }}, weight: 1,
+                             color: "{{ this.color }}", fillColor: "{{ this.color }}", fillOpacity: 0.85};
+                rows.forEach(function (r) {
+                    var marker = L.circleMarker([r[0], r[1]], style);
+                    if (fields.length) {
+                        marker.bindPopup(function () {
+                            return fields.map(function (f, i) { return "<b>" + f + "</b>: " + r[i + 2]; }).join("<br>");
+                        });
+                    }
+                    group.addLayer(marker);
+                });
+                return group;
+            })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, gdf, x, y, name, color, popup=(), radius=5, show=True):
+        super().__init__(name=name, overlay=True, control=True, show=show)
+        self._name = "CanvasPoints"
+        self.rows = _js(_rows(gdf, x, y, popup))
+        self.fields = _js([html.escape(f) for f in popup])
+        self.color = color
+        self.radius = radius
+
+
+def _js(value) -> str:
+    """Compact JSON that is safe to inline in a <script> block."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).replace("</", "<\\/")
+
+
+def _cluster_layer(gdf, x, y, layer_name, color, popup, radius):
+    fields = _js([html.escape(f) for f in popup])
+    callback = _CLUSTER_CALLBACK % {"fields": fields, "color": color, "radius": radius}
+    return FastMarkerCluster(_rows(gdf, x, y, popup), callback=callback, name=layer_name)
+
+
+def add_points(m, gdf, layer_name, color, popup=(), x="lon", y="lat", mode=None, max_markers=None, radius=5):
+    """Add ``gdf`` as a single-colour point layer, switching to a scalable backend for large layers.
+
+    Small layers use leafmap icon markers as before. Larger ones become a single
+    canvas circle-marker layer or a FastMarkerCluster, both of which ship coordinates as
+    data instead of per-marker HTML and JavaScript.
+    """
+    if gdf.empty:
+        return
+    popup = [f for f in popup if f in gdf.columns]
+    max_markers = MARKER_LIMIT if max_markers is None else max_markers
+    mode = mode or (POINT_MODE if len(gdf) > max_markers else "markers")
+    if mode == "markers":
+        m.add_points_from_xy(gdf, x=x, y=y, layer_name=layer_name, icon_colors=[color] * len(gdf), popup=popup)
+    elif mode == "cluster":
+        _cluster_layer(gdf, x, y, layer_name, color, popup, radius).add_to(m)
+    else:
+        CanvasPoints(gdf, x, y, layer_name, color, popup, radius).add_to(m)
+
+
+class LineTiles(VectorGridProtobuf):
+    """Vector-tile line layer coloured by each feature's ``color`` property, with click popups."""
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) -%}
+            var {{ this.get_name() }} = L.vectorGrid.protobuf('{{ this.url }}', {
+                rendererFactory: L.canvas.tile,
+                interactive: true,
+                maxNativeZoom: {{ this.max_native_zoom }},
+                vectorTileLayerStyles: {
+                    {{ this.layer|tojson }}: function (p, zoom) {
+                        return {color: p.color || "{{ this.default_color }}", weight: zoom < 12 ? 1 : 2.5, opacity: 0.9};
+                    }
+                }
+            });
+            {{ this.get_name() }}.on("click", function (e) {
+                var p = e.layer.properties, fields = {{ this.fields }};
+                var html = fields.filter(function (f) { return p[f] !== undefined; })
+                    .map(function (f) {
+                        var v = String(p[f]).replace(/[&<>"]/g, function (c) { return "&#" + c.charCodeAt(0) + ";"; });
+                        return "<b>" + f + "</b>: " + v;
+                    }).join("<br>");
+                if (html) { L.popup().setLatLng(e.latlng).setContent(html).openOn({{ this._parent.get_name() }}); }
+            });
+        {%- endmacro %}
+        """
+    )
+
+    def __init__(self, url, layer, name, popup=(), max_native_zoom=16, default_color="#9e9e9e"):
+        super().__init__(url, name=name)
+        self.layer = layer
+        self.fields = _js([html.escape(f) for f in popup])
+        self.max_native_zoom = max_native_zoom
+        self.default_color = default_color
+
+
+def add_density(m, image, name, opacity=0.75):
+    """Add a server-computed ``utils.density.DensityImage`` as a single image overlay."""
+    folium.raster_layers.ImageOverlay(image.data_url, image.bounds, name=name, opacity=opacity, zindex=400).add_to(m)
+
+
+def add_shapes(m, gdf, layer_name, zoom, style=None, popup=(), properties=(), topojson=None):
+    """Add ``gdf`` as a simplified, quantised GeoJSON/TopoJSON layer sized for ``zoom``; returns the Payload.
+
+    ``style`` is a Leaflet path-style dict or a folium ``style_function``; ``properties``
+    are extra columns it reads that are not shown in the tooltip. ``topojson`` defaults
+    to PAYLOAD_FORMAT.
+    """
+    topojson = PAYLOAD_FORMAT == "topojson" if topojson is None else topojson
+    popup = [f for f in popup if f in gdf.columns]
+    payload = build_payload(gdf, zoom, properties=[*popup, *properties], topojson=topojson, name="layer")
+    style_function = style if callable(style) else (lambda f, s=dict(style or {}): s)
+    tooltip = folium.GeoJsonTooltip(popup) if popup else None
+    if payload.fmt == "topojson":
+        folium.TopoJson(payload.data, "objects.layer", style_function=style_function, name=layer_name, tooltip=tooltip).add_to(m)
+    else:
+        folium.GeoJson(payload.data, name=layer_name, style_function=style_function, tooltip=tooltip).add_to(m)
+    return payload
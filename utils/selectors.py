@@ -0,0 +1,121 @@
+import re
+from typing import NamedTuple
+
+_CLAUSE = re.compile(
+    r'\[\s*(?P<neg>!)?\s*"(?P<key>(?:[^"\\]|\\.)*)"\s*'
+    r'(?:(?P<op>!=|!~|=|~)\s*"(?P<value>(?:[^"\\]|\\.)*)"\s*(?P<icase>,\s*i)?\s*)?\]'
+)
+_ERE_SPECIAL = re.compile(r"([.\[\]()*+?{}|^$\\])")
+
+# Relative cost of one tag filter. Exact key=value tests are answered from the tag index,
+# regexes must scan every value of the key, and negations cannot use the index at all.
+OP_COST = {"=": 1.0, "~": 2.0, "has": 4.0, "!=": 6.0, "!~": 6.0, "not": 6.0}
+CASELESS_PENALTY = 1.0
+# Keys present on a large share of objects make any filter on them expensive.
+COMMON_KEYS = {"name": 3.0, "building": 2.0, "highway": 1.5}
+
+
+class Clause(NamedTuple):
+    key: str
+    op: str  # "has", "not", "=", "!=", "~" or "!~"
+    value: str = ""  # as written inside the Overpass string literal
+    icase: bool = False
+
+    def render(self) -> str:
+        if self.op == "has":
+            return f'["{self.key}"]'
+        if self.op == "not":
+            return f'[!"{self.key}"]'
+        return f'["{self.key}"{self.op}"{self.value}"{",i" if self.icase else ""}]'
+
+    def cost(self) -> float:
+        base = OP_COST[self.op] + (CASELESS_PENALTY if self.icase else 0.0)
+        return base * COMMON_KEYS.get(self.key, 1.0)
+
+
+def parse_selector(selector: str):
+    """Split an Overpass tag selector such as '["amenity"="dairy"]["name"~"x",i]' into clauses."""
+    clauses, pos = [], 0
+    selector = selector.strip()
+    while pos < len(selector):
+        m = _CLAUSE.match(selector, pos)
+        if not m:
+            raise ValueError(f"Unsupported Overpass selector: {selector!r}")
+        if m["op"]:
+            clauses.append(Clause(m["key"], m["op"], m["value"], bool(m["icase"])))
+        else:
+            clauses.append(Clause(m["key"], "not" if m["neg"] else "has"))
+        pos = m.end()
+        while pos < len(selector) and selector[pos].isspace():
+            pos += 1
+    return tuple(clauses)
+
+
+def render_selector(clauses) -> str:
+    """Selector text with the cheapest filters first."""
+    return "".join(c.render() for c in sorted(clauses, key=Clause.cost))
+
+
+def selector_cost(clauses) -> float:
+    """The first (cheapest) filter selects candidates; the rest only test those candidates."""
+    costs = sorted(c.cost() for c in clauses)
+    return costs[0] + 0.25 * sum(costs[1:]) if costs else 0.0
+
+
+def _merge_clauses(clauses):
+    """One regex clause equivalent to OR-ing same-key positive value clauses."""
+    equal = [c.value for c in clauses if c.op == "="]
+    regexes = [c.value for c in clauses if c.op == "~"]
+    if equal:
+        # Escape for POSIX ERE, then double the backslashes for the Overpass string literal.
+        escaped = [_ERE_SPECIAL.sub(r"\\\\\1", v) for v in dict.fromkeys(equal)]
+        regexes.insert(0, "^(" + "|".join(escaped) + ")$")
+    return Clause(clauses[0].key, "~", "|".join(dict.fromkeys(regexes)), clauses[0].icase)
+
+
+def _merge_once(selectors):
+    groups = {}
+    for idx, clauses in enumerate(selectors):
+        for pos, clause in enumerate(clauses):
+            if clause.op not in ("=", "~"):
+                continue
+            rest = frozenset(clauses[:pos] + clauses[pos + 1:])
+            groups.setdefault((rest, clause.key, clause.icase), []).append((idx, clause))
+    for (rest, _, _), members in groups.items():
+        idxs = {idx for idx, _ in members}
+        if len(idxs) < 2:
+            continue
+        merged = _merge_clauses([clause for _, clause in members])
+        keep = [sel for i, sel in enumerate(selectors) if i not in idxs]
+        return keep + [tuple(rest) + (merged,)], True
+    return selectors, False
+
+
+class QueryPlan(NamedTuple):
+    selectors: tuple  # merged selector strings, cheapest filter first
+    cost: float
+    naive_cost: float
+
+    def statements(self, area: str, extra: str = ""):
+        """One ``nwr`` statement per selector over bbox ``area``, with optional extra filters (e.g. ``poly:``)."""
+        return [f"nwr{sel}({area}){extra};" for sel in self.selectors]
+
+
+def plan(selectors) -> QueryPlan:
+    """Merge compatible selectors into regex alternations and order their filters by cost.
+
+    Selectors that differ only in one positive test on the same key (with the same case
+    flag) collapse into a single selector; each surviving selector becomes one ``nwr``
+    statement instead of separate node/way/relation statements.
+    """
+    parsed = list(dict.fromkeys(parse_selector(s) for s in selectors))
+    naive_cost = 3 * sum(selector_cost(c) for c in parsed)
+    changed = True
+    while changed:
+        parsed, changed = _merge_once(parsed)
+    parsed.sort(key=selector_cost)
+    return QueryPlan(
+        selectors=tuple(render_selector(c) for c in parsed),
+        cost=sum(selector_cost(c) for c in parsed),
+        naive_cost=naive_cost,
+    )
@@ -0,0 +1,242 @@
+import re
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from utils.osm import layers_by_selectors, layers_to_gdfs, osm_keys
+from utils.snapshot import area_snapshot
+
+OTHER_CATEGORY = "Other"
+OTHER_COLOR = "#546e7a"
+
+SERVICE_CATEGORIES = {
+    "Krishi Vigyan Kendra": {
+        "color": "#2f7d32",
+        "selectors": ('["office"="government"]["name"~"krishi vigyan kendra",i]',),
+    },
+    "Agri Input & Fertilizer Dealer": {
+        "color": "#ef6c00",
+        "selectors": (
+            '["shop"~"agrarian|agricultural_supplies|fertilizer|farm_supply",i]',
+            '["amenity"="agricultural_service"]',
+            '["shop"="garden_centre"]["name"~"seed|fertilizer",i]',
+        ),
+    },
+    "Seed & Planting Material Centre": {
+        "color": "#558b2f",
+        "selectors": (
+            '["shop"~"seed|nursery",i]',
+            '["amenity"="marketplace"]["name"~"seed",i]',
+        ),
+    },
+    "Cold Storage & Warehousing": {
+        "color": "#1976d2",
+        "selectors": (
+            '["industrial"~"cold_storage",i]',
+            '["man_made"="storage_tank"]["name"~"cold storage",i]',
+            '["building"="warehouse"]["name"~"cold",i]',
+        ),
+    },
+    "Soil & Agronomy Lab": {
+        "color": "#8e24aa",
+        "selectors": (
+            '["amenity"="laboratory"]["name"~"soil|agro",i]',
+            '["amenity"="research_institute"]["name"~"soil|agri",i]',
+        ),
+    },
+    "Agri Machinery & Custom Hiring": {
+        "color": "#c2185b",
+        "selectors": (
+            '["shop"~"agro_equipment|tractor|farm_machinery",i]',
+            '["amenity"="workshop"]["name"~"tractor|agri",i]',
+        ),
+    },
+    "Dairy & Collection Centre": {
+        "color": "#0097a7",
+        "selectors": (
+            '["amenity"="milk_collection"]',
+            '["amenity"="dairy"]',
+            '["man_made"="works"]["name"~"chilling",i]',
+        ),
+    },
+    "Farmer Producer Org / Cooperative": {
+        "color": "#5d4037",
+        "selectors": (
+            '["office"="association"]["name"~"farmer|producer",i]',
+            '["office"="cooperative"]["name"~"agri|milk",i]',
+        ),
+    },
+}
+
+ALL_SELECTORS = tuple(sorted({sel for cfg in SERVICE_CATEGORIES.values() for sel in cfg["selectors"]}))
+VILLAGE_SELECTORS = ('["place"~"^(village|hamlet)$"]',)
+
+# Classification rules, checked top to bottom; the first matching rule wins.
+# A rule matches when any of its clauses matches; a clause matches when all of its
+# (tag, test) pairs hold on the lower-cased tag value. A string test is a regex
+# searched anywhere in the value, a set test requires an exact value.
+CATEGORY_RULES = (
+    ("Krishi Vigyan Kendra", (
+        (("name", "krishi vigyan kendra"),),
+        (("office", {"government"}), ("name", "krishi vigyan")),
+    )),
+    ("Agri Input & Fertilizer Dealer", (
+        (("shop", {"agrarian", "agricultural_supplies", "fertilizer", "farm_supply"}),),
+        (("amenity", {"agricultural_service"}),),
+        (("name", "fertilizer|pesticide"),),
+    )),
+    ("Seed & Planting Material Centre", (
+        (("name", "seed"),),
+        (("shop", {"seed", "nursery", "garden_centre"}),),
+    )),
+    ("Soil & Agronomy Lab", (
+        (("name", "soil"), ("name", "lab|testing")),
+        (("laboratory:type", "."),),
+        (("amenity", {"laboratory"}), ("name", "soil|agro")),
+        (("amenity", {"research_institute"}), ("name", "soil|agri")),
+    )),
+    ("Cold Storage & Warehousing", (
+        (("industrial", {"cold_storage"}),),
+        (("name", "cold"), ("name", "storage")),
+        (("building", {"warehouse"}), ("name", "cold")),
+    )),
+    ("Agri Machinery & Custom Hiring", (
+        (("name", "machinery|tractor"),),
+        (("shop", {"agro_equipment", "tractor"}),),
+        (("amenity", {"workshop"}), ("name", "tractor|agri")),
+    )),
+    ("Dairy & Collection Centre", (
+        (("amenity", {"milk_collection", "dairy"}),),
+        (("name", "milk"),),
+    )),
+    ("Farmer Producer Org / Cooperative", (
+        (("name", "producer company|fpo|farmers producer"),),
+        (("office", {"association", "cooperative"}), ("name", "farmer|milk|agri")),
+    )),
+    ("Dairy & Collection Centre", (
+        (("name", "chilling|collection centre"),),
+    )),
+)
+
+
+def _compile(rules):
+    compiled = []
+    for category, clauses in rules:
+        compiled.append((category, tuple(
+            tuple((key, frozenset(test) if isinstance(test, set) else re.compile(test)) for key, test in clause)
+            for clause in clauses
+        )))
+    return tuple(compiled)
+
+
+_RULES = _compile(CATEGORY_RULES)
+RULE_KEYS = tuple(sorted({key for _, clauses in _RULES for clause in clauses for key, _ in clause}))
+
+
+def _test(value, test):
+    if isinstance(test, frozenset):
+        return value in test
+    return test.search(value) is not None
+
+
+def classify_service(tags: dict) -> str:
+    """Category of a single facility from its OSM tags."""
+    values = {key: (tags.get(key) or "").lower() for key in RULE_KEYS}
+    for category, clauses in _RULES:
+        for clause in clauses:
+            if all(_test(values[key], test) for key, test in clause):
+                return category
+    return OTHER_CATEGORY
+
+
+def classify_services(tags: pd.Series) -> pd.Series:
+    """Vectorized ``classify_service`` over a column of tag dicts.
+
+    Each tag column is factorized, so every test runs once per distinct value and is
+    broadcast back to the rows through the codes; rules then combine as boolean arrays.
+    """
+    if tags.empty:
+        return pd.Series([], index=tags.index, dtype=object)
+    rows = tags.tolist()
+    columns = {}
+    for key in RULE_KEYS:
+        codes, uniques = pd.factorize(np.array([t.get(key) or "" for t in rows], dtype=object))
+        columns[key] = (codes, [str(u).lower() for u in uniques])
+    n = len(rows)
+    conditions, choices = [], []
+    for category, clauses in _RULES:
+        hit = np.zeros(n, dtype=bool)
+        for clause in clauses:
+            mask = np.ones(n, dtype=bool)
+            for key, test in clause:
+                codes, uniques = columns[key]
+                mask &= np.fromiter((_test(u, test) for u in uniques), dtype=bool, count=len(uniques))[codes]
+            hit |= mask
+        conditions.append(hit)
+        choices.append(category)
+    return pd.Series(np.select(conditions, choices, OTHER_CATEGORY), index=tags.index, dtype=object)
+
+
+def category_colors(categories: pd.Series) -> pd.Series:
+    colors = {category: cfg["color"] for category, cfg in SERVICE_CATEGORIES.items()}
+    return categories.map(colors).fillna(OTHER_COLOR)
+
+
+def area_layers(with_villages=True):
+    """Selector sets behind fetch_area_layers, keyed by layer name."""
+    return {"facilities": ALL_SELECTORS, "villages": VILLAGE_SELECTORS if with_villages else ()}
+
+
+def classify_facilities(facilities, previous=None, changed=()):
+    """Copy of ``facilities`` with its service ``category`` and map ``color`` columns filled in.
+
+    ``previous`` maps element keys (``osm.osm_keys``) to the categories of an earlier run;
+    those rows keep their category unless their key is in ``changed``, and only the rest are
+    classified.
+    """
+    if facilities.empty:
+        return facilities
+    facilities = facilities.copy()
+    category = pd.Series(None, index=facilities.index, dtype=object)
+    if previous is not None:
+        keys = osm_keys(facilities)
+        category = keys.map(previous).where(~keys.isin(set(changed)))
+    todo = category.isna()
+    category[todo] = classify_services(facilities.loc[todo, "tags"])
+    facilities["category"] = category
+    facilities["color"] = category_colors(facilities["category"])
+    return facilities
+
+
+def fetch_area_layers(bbox, with_villages=True, classify=True, aoi=None):
+    """Facilities (classified unless ``classify=False``) and optional villages from one Overpass request.
+
+    With an ``aoi`` (utils.aoi.AOI) the request is limited to its boundary and results are clipped to it.
+    """
+    poly = aoi.overpass_poly if aoi is not None else None
+    result = layers_by_selectors(bbox, area_layers(with_villages), key_hints={"villages": "place"}, poly=poly)
+    facilities, villages = result["facilities"], result["villages"]
+    if aoi is not None:
+        facilities, villages = aoi.clip(facilities), aoi.clip(villages)
+    if classify:
+        facilities = classify_facilities(facilities)
+    if villages.empty:
+        villages = gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    return facilities, villages
+
+
+def snapshot_area_layers(bbox, with_villages=True, aoi=None, refresh=False):
+    """Unclassified facilities and villages from the area's stored snapshot (see ``utils.snapshot``).
+
+    Returns ``(facilities, villages, snapshot)``; ``refresh=True`` first brings the snapshot
+    up to date with an Overpass diff, and ``snapshot.changes`` says what it touched.
+    """
+    poly = aoi.overpass_poly if aoi is not None else None
+    layers = area_layers(with_villages)
+    snapshot = area_snapshot(bbox, layers, poly=poly, refresh=refresh)
+    result = layers_to_gdfs(snapshot.layers, layers, key_hints={"villages": "place"})
+    facilities, villages = result["facilities"], result["villages"]
+    if aoi is not None:
+        facilities, villages = aoi.clip(facilities), aoi.clip(villages)
+    return facilities, villages, snapshot
@@ -0,0 +1,192 @@
+"""Stored area snapshots that are refreshed from Overpass diffs instead of being downloaded again.
+
+A snapshot holds the raw elements of each layer fetched for an area together with the
+Overpass ``osm_base`` timestamp they reflect. A refresh asks Overpass for the ids that
+match now and the full elements created or modified after that timestamp, then upserts
+those and drops the rest. Objects whose geometry changes only through their member
+nodes keep their old centre until they are edited themselves or the snapshot is dropped.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from utils.cache import CACHE_DIR, cache_key
+from utils.osm import element_key, elements_by_key, layer_changes, layer_elements
+
+SNAPSHOT_PATH = os.environ.get("MAPLAB_SNAPSHOTS", os.path.join(CACHE_DIR, "snapshots.sqlite"))
+
+
+class Changes(NamedTuple):
+    """Element keys (see ``osm.element_key``) per layer touched by one refresh."""
+
+    added: dict
+    modified: dict
+    deleted: dict
+
+    def upserted(self, layer) -> set:
+        return self.added.get(layer, set()) | self.modified.get(layer, set())
+
+    @property
+    def count(self) -> int:
+        return sum(len(keys) for part in self for keys in part.values())
+
+
+class Snapshot(NamedTuple):
+    layers: dict  # layer name -> Overpass elements
+    osm_base: Optional[str]
+    since: Optional[str]  # osm_base the refresh started from; None for a full fetch
+    changes: Optional[Changes]  # None when everything was (re)fetched or read unchanged
+    fetched_bytes: int  # JSON size of the elements downloaded for this call
+
+
+def _size(elements) -> int:
+    return sum(len(json.dumps(el, separators=(",", ":"))) for el in elements)
+
+
+def _id_element(key):
+    """The ``out ids`` element behind an element key."""
+    osm_type, _, osm_id = key.partition("/")
+    return {"type": osm_type, "id": int(osm_id)}
+
+
+class SnapshotStore:
+    """SQLite table of snapshot elements keyed by area, layer and element key."""
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS snapshots (area TEXT PRIMARY KEY, osm_base TEXT, updated REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS elements (
+                area TEXT NOT NULL,
+                layer TEXT NOT NULL,
+                key TEXT NOT NULL,
+                element TEXT NOT NULL,
+                PRIMARY KEY (area, layer, key)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def load(self, area):
+        """``(osm_base, {layer: elements})`` for ``area``, or None if it has no snapshot."""
+        with self._lock:
+            row = self._db.execute("SELECT osm_base FROM snapshots WHERE area = ?", (area,)).fetchone()
+            if row is None:
+                return None
+            layers = {}
+            for layer, element in self._db.execute(
+                "SELECT layer, element FROM elements WHERE area = ? ORDER BY layer, key", (area,)
+            ):
+                layers.setdefault(layer, []).append(json.loads(element))
+        return row[0], layers
+
+    def replace(self, area, osm_base, layers):
+        """Store a full fetch of ``area``, dropping whatever was there."""
+        rows = [
+            (area, layer, element_key(el), json.dumps(el, ensure_ascii=False))
+            for layer, elements in layers.items() for el in elements
+        ]
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM elements WHERE area = ?", (area,))
+                self._db.executemany("INSERT OR REPLACE INTO elements VALUES (?, ?, ?, ?)", rows)
+                self._db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)", (area, osm_base, time.time()))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def apply(self, area, osm_base, current, changed) -> Changes:
+        """Upsert the ``changed`` elements and delete keys no longer in ``current`` (both per layer)."""
+        added, modified, deleted = {}, {}, {}
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for layer, keys in current.items():
+                    stored = {k for (k,) in self._db.execute(
+                        "SELECT key FROM elements WHERE area = ? AND layer = ?", (area, layer)
+                    )}
+                    rows = [(area, layer, element_key(el), json.dumps(el, ensure_ascii=False)) for el in changed.get(layer, [])]
+                    upserted = {r[2] for r in rows}
+                    added[layer], modified[layer] = upserted - stored, upserted & stored
+                    deleted[layer] = stored - keys
+                    self._db.executemany(
+                        "DELETE FROM elements WHERE area = ? AND layer = ? AND key = ?",
+                        [(area, layer, k) for k in deleted[layer]],
+                    )
+                    self._db.executemany("INSERT OR REPLACE INTO elements VALUES (?, ?, ?, ?)", rows)
+                self._db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)", (area, osm_base, time.time()))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return Changes(added, modified, deleted)
+
+    def stored_keys(self, area, layer) -> set:
+        with self._lock:
+            return {k for (k,) in self._db.execute(
+                "SELECT key FROM elements WHERE area = ? AND layer = ?", (area, layer)
+            )}
+
+
+_default = None
+_default_pid = None
+_default_lock = threading.Lock()
+
+
+def get_snapshots() -> SnapshotStore:
+    global _default, _default_pid
+    with _default_lock:
+        if _default is None or _default_pid != os.getpid():
+            _default, _default_pid = SnapshotStore(), os.getpid()
+        return _default
+
+
+def snapshot_key(bbox, layers, poly=None) -> str:
+    """Snapshot identity: the extent, boundary filter and selectors that were queried."""
+    spec = {name: sorted(selectors) for name, selectors in layers.items()}
+    return cache_key("snapshot", json.dumps([[round(c, 6) for c in bbox], poly, spec], sort_keys=True))
+
+
+def area_snapshot(bbox, layers, poly=None, refresh=False, tile_deg=None) -> Snapshot:
+    """Elements of ``layers`` (name -> selectors) for an area, from its snapshot when there is one.
+
+    Without a snapshot everything is fetched and stored. ``refresh=True`` brings an
+    existing snapshot up to date with a diff query; snapshots without an ``osm_base``
+    (taken from the offline store) are re-read in full instead.
+    """
+    store = get_snapshots()
+    area = snapshot_key(bbox, layers, poly)
+    stored = store.load(area)
+    if stored is not None and not refresh:
+        return Snapshot({name: stored[1].get(name, []) for name in layers}, stored[0], None, None, 0)
+    if stored is None or not stored[0]:
+        split, osm_base = layer_elements(bbox, layers, tile_deg, poly)
+        store.replace(area, osm_base, split)
+        return Snapshot(split, osm_base, None, None, _size(e for els in split.values() for e in els))
+    since = stored[0]
+    current, changed, osm_base = layer_changes(bbox, layers, since, tile_deg, poly)
+    fetched = _size(_id_element(k) for keys in current.values() for k in keys)
+    fetched += _size(e for els in changed.values() for e in els)
+    # Objects that entered the area without being edited themselves (e.g. a way whose nodes
+    # moved) are not newer than ``since``; look them up by id.
+    missing = {
+        layer: keys - store.stored_keys(area, layer) - {element_key(el) for el in changed[layer]}
+        for layer, keys in current.items()
+    }
+    if any(missing.values()):
+        found = {element_key(el): el for el in elements_by_key(set().union(*missing.values()))}
+        fetched += _size(found.values())
+        for layer, keys in missing.items():
+            changed[layer] = changed[layer] + [found[k] for k in keys if k in found]
+    changes = store.apply(area, osm_base, current, changed)
+    layers_now = store.load(area)[1]
+    return Snapshot({name: layers_now.get(name, []) for name in layers}, osm_base, since, changes, fetched)
@@ -0,0 +1,115 @@
+import codecs
+import json
+import re
+import zlib
+
+CHUNK_SIZE = 1 << 16
+
+_ELEMENTS_START = re.compile(r'"elements"\s*:\s*\[')
+_SKIP = re.compile(r"[\s,]*")
+
+
+def inflate(chunks):
+    """Yield decompressed bytes for gzip/zlib input, passing plain bytes through."""
+    chunks = iter(chunks)
+    first = b""
+    for chunk in chunks:  # the gzip magic is two bytes, so sniff only once both are in
+        first += chunk
+        if len(first) >= 2:
+            break
+    if not first:
+        return
+    if first[:2] == b"\x1f\x8b":
+        dec = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif first[:1] == b"\x78":
+        dec = zlib.decompressobj()
+    else:
+        yield first
+        yield from chunks
+        return
+    yield dec.decompress(first)
+    for chunk in chunks:
+        yield dec.decompress(chunk)
+    yield dec.flush()
+
+
+def blob_chunks(blob: bytes, size=CHUNK_SIZE):
+    for i in range(0, len(blob), size):
+        yield blob[i:i + size]
+
+
+class ElementStream:
+    """Iterate the ``elements`` array of an Overpass JSON body one element at a time.
+
+    Only the element being decoded is held in memory. The other top-level fields
+    (``osm3s``, ``remark``, ...) are available in ``meta`` once iteration finishes,
+    and ``on_complete(meta)`` is called at that point.
+    """
+
+    def __init__(self, chunks, on_complete=None):
+        self._chunks = iter(inflate(chunks))
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._on_complete = on_complete
+        self.meta = {}
+
+    def _read(self):
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                return text
+        return None
+
+    def __iter__(self):
+        buf = ""
+        while True:
+            m = _ELEMENTS_START.search(buf)
+            if m:
+                break
+            more = self._read()
+            if more is None:
+                raise ValueError("Overpass response has no 'elements' array.")
+            buf += more
+        head = buf[:m.start()].rstrip().rstrip(",")
+        buf = buf[m.end():]
+        pos = 0
+        need = 0
+        eof = False
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == "]":
+                break
+            if pos < len(buf) and (eof or len(buf) - pos >= need):
+                try:
+                    el, end = self._json.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                    # Element split across chunks; wait until twice as much text is buffered.
+                    need = 2 * (len(buf) - pos) + 1
+                else:
+                    need = 0
+                    pos = end
+                    yield el
+                    continue
+            elif eof:
+                raise ValueError("Overpass response ended inside the 'elements' array.")
+            more = self._read()
+            if more is None:
+                eof = True
+                continue
+            buf = buf[pos:] + more
+            pos = 0
+        tail = buf[pos + 1:]
+        while True:
+            more = self._read()
+            if more is None:
+                break
+            tail += more
+        tail = tail.lstrip().lstrip(",").lstrip()
+        if tail.startswith("}") or head.endswith("{"):
+            self.meta = json.loads(head + tail)
+        else:
+            self.meta = json.loads(head + "," + tail)
+        if self._on_complete is not None:
+            self._on_complete(self.meta)
@@ -1,12 +1,115 @@
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Geod
+
+# Upper bin edges in km/h (a value equal to an edge falls in the lower bin), then "faster".
+SPEED_BINS = np.array([30.0, 50.0, 70.0, 90.0])
+SPEED_LABELS = ["≤30", "31–50", "51–70", "71–90", ">90", "unknown"]
+SPEED_COLORS = ["#1a9850", "#66bd63", "#fee08b", "#fdae61", "#d73027", "#9e9e9e"]
+UNKNOWN_BIN = len(SPEED_COLORS) - 1
+# One style dict per bin, built once; features only carry their bin index.
+BIN_STYLES = [
+    {"color": color, "weight": 1.5 if b == UNKNOWN_BIN else 2.5, "opacity": 0.6 if b == UNKNOWN_BIN else 0.9}
+    for b, color in enumerate(SPEED_COLORS)
+]
+
+UNIT_FACTORS = {"": 1.0, "km/h": 1.0, "kmh": 1.0, "kph": 1.0, "mph": 1.609344, "knots": 1.852}
+# Implicit limits (maxspeed=<country>:<zone>); the zone decides when the country is not listed.
+IMPLICIT_SPEEDS = {
+    "in:urban": 50.0,
+    "in:rural": 80.0,
+    "in:nh": 100.0,
+    "in:expressway": 120.0,
+    "in:motorway": 120.0,
+}
+ZONE_SPEEDS = {"urban": 50.0, "rural": 80.0, "trunk": 100.0, "motorway": 120.0, "living_street": 20.0, "zone30": 30.0}
+WORD_SPEEDS = {"none": np.inf, "walk": 7.0}
+_NUMERIC = r"^\s*(\d+(?:\.\d+)?)\s*(km/h|kmh|kph|mph|knots)?\s*$"
+_GEOD = Geod(ellps="WGS84")
+
+
+def _parse_unique(values: pd.Series) -> pd.Series:
+    """km/h for each distinct single maxspeed token (no ';')."""
+    text = values.str.strip().str.lower()
+    parts = text.str.extract(_NUMERIC)
+    kmh = pd.to_numeric(parts[0], errors="coerce") * parts[1].fillna("").map(UNIT_FACTORS)
+    implicit = text.map(IMPLICIT_SPEEDS)
+    zone = text.str.split(":").str[-1].map(ZONE_SPEEDS)
+    words = text.map(WORD_SPEEDS)
+    return kmh.fillna(implicit).fillna(words).fillna(zone).astype("float64")
+
+
+def parse_maxspeed(values) -> np.ndarray:
+    """km/h per maxspeed tag: "50", "30 mph", "IN:urban", "none" (inf), "50;70" (lowest); NaN if unknown.
+
+    Parsing runs once per distinct string, so a road network with thousands of
+    segments but a few dozen distinct tags costs a few dozen regex evaluations.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype="object"), use_na_sentinel=True)
+    if not len(uniques):
+        return np.full(len(codes), np.nan)
+    tokens = pd.Series(uniques, dtype="string").str.split(";").explode()
+    parsed = _parse_unique(tokens.astype("string")).groupby(level=0).min()
+    lookup = np.append(parsed.reindex(range(len(uniques))).to_numpy(dtype="float64"), np.nan)
+    return lookup[codes]  # the NA sentinel (-1) picks the trailing NaN
+
+
+def speed_bins(kmh) -> np.ndarray:
+    """Bin index per speed: 0..len(SPEED_BINS) from np.digitize, UNKNOWN_BIN for NaN."""
+    kmh = np.asarray(kmh, dtype="float64")
+    bins = np.digitize(kmh, SPEED_BINS, right=True)
+    bins[np.isnan(kmh)] = UNKNOWN_BIN
+    return bins
+
+
+def speed_colors(kmh) -> np.ndarray:
+    return np.asarray(SPEED_COLORS, dtype=object)[speed_bins(kmh)]
+
+
 def speed_color(v):
-    try:
-        digits = ''.join(ch for ch in str(v) if ch.isdigit())
-        v = int(digits) if digits else None
-    except Exception:
-        v = None
-    if v is None: return "#9e9e9e"
-    if v <= 30: return "#1a9850"
-    if v <= 50: return "#66bd63"
-    if v <= 70: return "#fee08b"
-    if v <= 90: return "#fdae61"
-    return "#d73027"
+    """Colour for a single maxspeed value (see parse_maxspeed)."""
+    return speed_colors(parse_maxspeed([v]))[0]
+
+
+def tag_values(tags, key) -> np.ndarray:
+    """Value of ``key`` from each tags dict (None when absent)."""
+    return np.asarray([t.get(key) if isinstance(t, dict) else None for t in tags], dtype=object)
+
+
+def geodesic_lengths_km(geoms) -> np.ndarray:
+    """WGS84 geodesic length of each line, from one vectorised Geod.inv over all segments."""
+    geoms = np.asarray(geoms)
+    coords, owner = shapely.get_coordinates(geoms, return_index=True)
+    out = np.zeros(len(geoms))
+    if len(coords) < 2:
+        return out
+    same = owner[1:] == owner[:-1]
+    a, b = coords[:-1][same], coords[1:][same]
+    _, _, dist = _GEOD.inv(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+    return np.bincount(owner[:-1][same], weights=dist, minlength=len(geoms)) / 1000.0
+
+
+def speed_stats(classes, kmh, length_km) -> pd.DataFrame:
+    """Length-weighted maxspeed summary per road class.
+
+    ``tagged_pct`` is the share of length with a usable limit; ``mean_kmh`` is the
+    length-weighted mean over that tagged length (unlimited segments excluded).
+    """
+    frame = pd.DataFrame({"class": classes, "kmh": kmh, "km": length_km})
+    finite = np.isfinite(frame["kmh"])
+    frame["tagged_km"] = np.where(frame["kmh"].notna(), frame["km"], 0.0)
+    frame["weighted"] = np.where(finite, frame["kmh"] * frame["km"], 0.0)
+    frame["finite_km"] = np.where(finite, frame["km"], 0.0)
+    grouped = frame.groupby("class", dropna=False)[["km", "tagged_km", "weighted", "finite_km"]].sum()
+    finite_km = grouped["finite_km"].to_numpy()
+    weighted = grouped["weighted"].to_numpy()
+    out = pd.DataFrame(
+        {
+            "length_km": grouped["km"].round(2),
+            "tagged_pct": (100 * grouped["tagged_km"] / grouped["km"].where(grouped["km"] > 0)).round(1),
+            "mean_kmh": np.round(np.divide(weighted, finite_km, out=np.full(len(grouped), np.nan), where=finite_km > 0), 1),
+        },
+        index=grouped.index,
+    )
+    return out.sort_values("length_km", ascending=False).rename_axis("class").reset_index()
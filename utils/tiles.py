@@ -0,0 +1,340 @@
+"""Mapbox Vector Tiles for line layers, served from an in-process HTTP endpoint or MBTiles.
+
+A TileSet cuts a line GeoDataFrame into MVT tiles on demand: each tile is clipped,
+simplified to about half a screen pixel at its zoom, stripped of lines shorter than
+MIN_PIXELS, capped at MAX_TILE_FEATURES lines and, below ``detail_zoom``, stripped of
+detail-only attributes. Tiles are kept in an LRU
+cache, so the browser only ever pulls the tiles in view instead of the whole network.
+"""
+import gzip
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+EXTENT = 4096
+BUFFER = 64  # tile units of overlap so line joins do not show seams
+MIN_ZOOM = 6
+MAX_ZOOM = 16  # Leaflet overzooms beyond this
+TILE_CACHE_SIZE = int(os.environ.get("MAPLAB_TILE_CACHE", 4096))
+TILE_HOST = os.environ.get("MAPLAB_TILE_HOST", "127.0.0.1")
+TILE_PORT = int(os.environ.get("MAPLAB_TILE_PORT", 0))  # 0 picks a free port
+# Base URL at which the browser reaches the tile server (e.g. behind a reverse proxy). Pages only
+# stream tiles when it is set: the http://host:port default is unreachable from a remote browser
+# and blocked as mixed content on HTTPS deployments.
+TILE_PUBLIC_URL = os.environ.get("MAPLAB_TILE_PUBLIC_URL", "")
+MAX_TILESETS = 8
+MIN_PIXELS = 2.0  # lines shorter than this on screen are dropped from a tile
+MAX_TILE_FEATURES = 4000  # densest tiles keep their longest lines, bounding tile size at low zoom
+
+ORIGIN = 20037508.342789244
+_TO_3857 = Transformer.from_crs(4326, 3857, always_xy=True)
+
+
+# -- protobuf encoding (vector_tile.proto, version 2) -----------------------
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Length-delimited field (wire type 2)."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _uint_field(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _packed(number: int, values) -> bytes:
+    return _field(number, b"".join(_varint(v) for v in values))
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _value(v) -> bytes:
+    if isinstance(v, (bool, np.bool_)):
+        return _uint_field(7, int(v))
+    if isinstance(v, (int, np.integer)):
+        return _uint_field(6, _zigzag(int(v)))
+    if isinstance(v, (float, np.floating)):
+        return _varint(3 << 3 | 1) + np.float64(v).tobytes()
+    return _field(1, str(v).encode("utf-8"))
+
+
+def encode_layer(name, features, extent=EXTENT) -> bytes:
+    """One MVT layer; ``features`` are (geometry command ints, geom_type, properties dict)."""
+    keys, values = {}, {}
+    body = [_uint_field(15, 2), _field(1, name.encode("utf-8"))]
+    for geometry, geom_type, props in features:
+        tags = []
+        for k, v in props.items():
+            if v is None or v == "" or (isinstance(v, float) and math.isnan(v)):
+                continue
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault((type(v).__name__, v), len(values)))
+        body.append(_field(2, _packed(2, tags) + _uint_field(3, geom_type) + _packed(4, geometry)))
+    body += [_field(3, k.encode("utf-8")) for k in keys]
+    body += [_field(4, _value(v)) for _, v in values]
+    body.append(_uint_field(5, extent))
+    return _field(3, b"".join(body))
+
+
+def _line_commands(parts):
+    """MoveTo/LineTo command stream for integer line parts, with a cursor shared across parts."""
+    cmds, cx, cy = [], 0, 0
+    for pts in parts:
+        cmds += [9, _zigzag(int(pts[0, 0]) - cx), _zigzag(int(pts[0, 1]) - cy)]  # MoveTo(1)
+        deltas = np.diff(pts, axis=0)
+        cmds.append((len(deltas) << 3) | 2)  # LineTo(n)
+        cmds += [_zigzag(int(d)) for d in deltas.ravel()]
+        cx, cy = int(pts[-1, 0]), int(pts[-1, 1])
+    return cmds
+
+
+# -- tiling -----------------------------------------------------------------
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) of an XYZ tile in EPSG:3857 metres."""
+    span = 2 * ORIGIN / 2 ** z
+    west, north = -ORIGIN + x * span, ORIGIN - y * span
+    return west, north - span, west + span, north
+
+
+def tiles_for_bbox(bbox, z):
+    """XYZ tiles covering a (south, west, north, east) bbox at zoom z."""
+    s, w, n, e = bbox
+    def to_xy(lat, lon):
+        lat = max(min(lat, 85.0511), -85.0511)
+        x = (lon + 180) / 360 * 2 ** z
+        y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * 2 ** z
+        return int(min(max(x, 0), 2 ** z - 1)), int(min(max(y, 0), 2 ** z - 1))
+    x0, y0 = to_xy(n, w)
+    x1, y1 = to_xy(s, e)
+    return [(z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+class TileSet:
+    """On-demand MVT tiles for the lines in ``gdf`` (EPSG:4326)."""
+
+    def __init__(self, gdf, layer="lines", properties=("color",), detail_properties=("name",),
+                 detail_zoom=14, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+        gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+        self.layer = layer
+        self.min_zoom, self.max_zoom, self.detail_zoom = min_zoom, max_zoom, detail_zoom
+        w, s, e, n = gdf.total_bounds if len(gdf) else (0, 0, 0, 0)
+        self.bbox = (s, w, n, e)
+        self.geoms = shapely.transform(gdf.geometry.to_numpy(), lambda c: np.column_stack(_TO_3857.transform(c[:, 0], c[:, 1])))
+        self.tree = shapely.STRtree(self.geoms)
+        self.columns = {c: gdf[c].tolist() for c in (*properties, *detail_properties) if c in gdf.columns}
+        self.properties = [c for c in properties if c in self.columns]
+        self.detail_properties = [c for c in detail_properties if c in self.columns]
+
+    def tile(self, z, x, y) -> bytes:
+        """Encoded MVT for one tile (an empty tile outside the data or the zoom range)."""
+        if not (self.min_zoom <= z <= self.max_zoom) or not len(self.geoms):
+            return b""
+        west, south, east, north = tile_bounds(z, x, y)
+        span = east - west
+        pad = span * BUFFER / EXTENT
+        hits = self.tree.query(shapely.box(west - pad, south - pad, east + pad, north + pad))
+        if not len(hits):
+            return b""
+        hits.sort()
+        pixel = span / 256
+        clipped = shapely.clip_by_rect(self.geoms[hits], west - pad, south - pad, east + pad, north + pad)
+        clipped = shapely.simplify(clipped, pixel / 2, preserve_topology=False)
+        lengths = shapely.length(clipped)
+        keep = np.flatnonzero(~shapely.is_empty(clipped) & (lengths >= MIN_PIXELS * pixel))
+        if len(keep) > MAX_TILE_FEATURES:
+            keep = np.sort(keep[np.argsort(-lengths[keep], kind="stable")[:MAX_TILE_FEATURES]])
+        hits, clipped = hits[keep], clipped[keep]
+        parts, owner = shapely.get_parts(clipped, return_index=True)
+        coords, part_of = shapely.get_coordinates(parts, return_index=True)
+        grid = np.empty_like(coords, dtype="int64")
+        grid[:, 0] = np.round((coords[:, 0] - west) / span * EXTENT)
+        grid[:, 1] = np.round((north - coords[:, 1]) / span * EXTENT)
+        starts = np.searchsorted(part_of, np.arange(len(parts) + 1))
+
+        names = self.properties + (self.detail_properties if z >= self.detail_zoom else [])
+        features, current, feature_parts = [], None, []
+        def flush():
+            if feature_parts:
+                idx = hits[current]
+                props = {c: self.columns[c][idx] for c in names}
+                features.append((_line_commands(feature_parts), 2, props))
+        for p in range(len(parts)):
+            pts = grid[starts[p]:starts[p + 1]]
+            if len(pts) > 1:
+                # Quantisation can collapse neighbouring vertices; drop the repeats.
+                pts = pts[np.r_[True, np.any(np.diff(pts, axis=0) != 0, axis=1)]]
+            if owner[p] != current:
+                flush()
+                current, feature_parts = owner[p], []
+            if len(pts) > 1:
+                feature_parts.append(pts)
+        flush()
+        return encode_layer(self.layer, features) if features else b""
+
+
+def write_mbtiles(tileset: TileSet, path, min_zoom=None, max_zoom=None, name="lines") -> int:
+    """Pre-render ``tileset`` into an MBTiles file (gzip-compressed PBF tiles); returns the tile count."""
+    min_zoom = tileset.min_zoom if min_zoom is None else min_zoom
+    max_zoom = tileset.max_zoom if max_zoom is None else max_zoom
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    db.executescript(
+        """
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        """
+    )
+    s, w, n, e = tileset.bbox
+    fields = {c: "String" for c in tileset.properties + tileset.detail_properties}
+    metadata = {
+        "name": name,
+        "format": "pbf",
+        "bounds": f"{w},{s},{e},{n}",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "json": '{"vector_layers": [{"id": "%s", "fields": %s}]}' % (tileset.layer, str(fields).replace("'", '"')),
+    }
+    db.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+    count = 0
+    for z in range(min_zoom, max_zoom + 1):
+        for _, x, y in tiles_for_bbox(tileset.bbox, z):
+            data = tileset.tile(z, x, y)
+            if data:
+                db.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)", (z, x, 2 ** z - 1 - y, gzip.compress(data)))
+                count += 1
+    db.commit()
+    db.close()
+    return count
+
+
+class MBTilesSource:
+    """Tiles read from an MBTiles file, for the tile server."""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def tile(self, z, x, y) -> bytes:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, 2 ** z - 1 - y),
+            ).fetchone()
+        if not row:
+            return b""
+        data = row[0]
+        return gzip.decompress(data) if data[:2] == b"\x1f\x8b" else data
+
+
+# -- serving ----------------------------------------------------------------
+
+class TileServer:
+    """Background HTTP server for ``/<tileset>/<z>/<x>/<y>.pbf`` with an LRU tile cache."""
+
+    def __init__(self, host=TILE_HOST, port=TILE_PORT, cache_size=TILE_CACHE_SIZE):
+        self.sources = OrderedDict()
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                try:
+                    source_id, z, x, y = parts[0], int(parts[1]), int(parts[2]), int(parts[3].split(".")[0])
+                    data = server.tile(source_id, z, x, y)
+                except (IndexError, ValueError, KeyError):
+                    self.send_error(404)
+                    return
+                body = gzip.compress(data, 5) if data else b""
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-protobuf")
+                if body:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.send_header("Cache-Control", "max-age=3600")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = TILE_PUBLIC_URL.rstrip("/") or f"http://{host}:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def publish(self, source_id, factory):
+        """Register the source built by ``factory()`` (once per id); returns its XYZ URL template."""
+        with self._lock:
+            if source_id not in self.sources:
+                self.sources[source_id] = factory()
+                while len(self.sources) > MAX_TILESETS:
+                    self.sources.popitem(last=False)
+            self.sources.move_to_end(source_id)
+        return f"{self.base_url}/{source_id}/{{z}}/{{x}}/{{y}}.pbf"
+
+    def get(self, source_id):
+        with self._lock:
+            return self.sources.get(source_id)
+
+    def tile(self, source_id, z, x, y) -> bytes:
+        key = (source_id, z, x, y)
+        with self._lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            source = self.sources[source_id]
+        self.misses += 1
+        data = source.tile(z, x, y)
+        with self._lock:
+            self.cache[key] = data
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return data
+
+
+_server = None
+_server_pid = None
+_server_lock = threading.Lock()
+
+
+def get_tile_server() -> TileServer:
+    global _server, _server_pid
+    with _server_lock:
+        if _server is None or _server_pid != os.getpid():
+            _server, _server_pid = TileServer(), os.getpid()
+        return _server
+
+
+def tileset_id(*parts) -> str:
+    return hashlib.sha1("|".join(map(str, parts)).encode("utf-8")).hexdigest()[:16]